@@ -0,0 +1,128 @@
+"""
+Result caches keyed to the rule set version
+"""
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple, Hashable
+import threading
+import time
+import logging
+
+from .config import settings
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+def recommendation_key(
+    items: List[str],
+    top_n: int,
+    min_confidence: float,
+    min_lift: float
+) -> Hashable:
+    """
+    Normalized cart (sorted, lower-cased, de-duplicated) plus scoring parameters
+    """
+    return (
+        tuple(sorted({item.lower() for item in items})),
+        top_n,
+        min_confidence,
+        min_lift
+    )
+
+class ResultCache:
+    """
+    Bounded LRU cache with a TTL
+
+    The whole cache is dropped when the rule set version changes, so entries
+    never outlive the rules they were computed from.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float, enabled: bool = True):
+        self.name = name
+        self.enabled = enabled
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = None
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any, version):
+        """
+        Store a result computed while `version` was current
+        """
+        with self._lock:
+            # Rule set changed while the result was computed: don't keep it
+            if version != self.version:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, version=None):
+        """
+        Drop all entries (called when the rule set changes)
+        """
+        with self._lock:
+            self.version = version
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+        logger.info(f"✓ {self.name} cache invalidated (rule set version {version})")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "version": self.version
+            }
+
+recommendation_cache = ResultCache(
+    "Recommendation",
+    settings.recommendation_cache_size,
+    settings.recommendation_cache_ttl,
+    enabled=settings.use_recommendation_cache
+)
+
+# GET /rules totals per filter tuple
+rule_count_cache = ResultCache(
+    "Rule count",
+    settings.rule_count_cache_size,
+    settings.rule_count_cache_ttl
+)
+
+def _cache_samples(field: str):
+    return lambda: [
+        ({"cache": name}, cache.stats()[field])
+        for name, cache in (("recommendations", recommendation_cache), ("rule_counts", rule_count_cache))
+    ]
+
+registry.callback("mba_cache_hits_total", "Result cache hits", "counter", _cache_samples("hits"))
+registry.callback("mba_cache_misses_total", "Result cache misses", "counter", _cache_samples("misses"))
+registry.callback("mba_cache_hit_ratio", "Result cache hits / lookups", "gauge", _cache_samples("hit_ratio"))
+registry.callback("mba_cache_entries", "Result cache entries", "gauge", _cache_samples("size"))
@@ -0,0 +1,113 @@
+"""
+Columnar (Arrow IPC stream / Parquet) encoding of rule rows
+"""
+from typing import List, Tuple, Iterable, Iterator, AsyncIterable, AsyncIterator, Optional
+import logging
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional: JSON, NDJSON and CSV responses work without it
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+PARQUET_MEDIA_TYPE = "application/vnd.apache.parquet"
+
+MEDIA_TYPES = {"arrow": ARROW_STREAM_MEDIA_TYPE, "parquet": PARQUET_MEDIA_TYPE}
+
+# Same column order as crud.EXPORT_COLUMNS
+RULE_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("antecedent", pa.string()),
+    ("consequent", pa.string()),
+    ("support", pa.float64()),
+    ("confidence", pa.float64()),
+    ("lift", pa.float64()),
+    ("created_at", pa.timestamp("us")),
+]) if pa is not None else None
+
+def is_available() -> bool:
+    return pa is not None
+
+def record_batch(rows: List[Tuple]) -> "pa.RecordBatch":
+    """
+    Transpose query rows straight into Arrow columns
+    """
+    columns = zip(*rows) if rows else ([] for _ in RULE_SCHEMA)
+    return pa.RecordBatch.from_arrays(
+        [pa.array(values, type=field.type) for values, field in zip(columns, RULE_SCHEMA)],
+        schema=RULE_SCHEMA
+    )
+
+class _ChunkSink:
+    """
+    Write-only file object; the writer's output is drained after each batch
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _writer(sink: _ChunkSink, fmt: str):
+    if fmt == "parquet":
+        return pq.ParquetWriter(sink, RULE_SCHEMA)
+    return pa.ipc.new_stream(sink, RULE_SCHEMA)
+
+def iter_encoded(batches: Iterable[List[Tuple]], fmt: str) -> Iterator[bytes]:
+    """
+    Encode row batches as one Arrow stream or Parquet file, yielding bytes
+    as they are produced (one record batch / row group per input batch)
+    """
+    sink = _ChunkSink()
+    writer = _writer(sink, fmt)
+    for rows in batches:
+        writer.write_batch(record_batch(rows))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+async def aiter_encoded(batches: AsyncIterable[List[Tuple]], fmt: str) -> AsyncIterator[bytes]:
+    sink = _ChunkSink()
+    writer = _writer(sink, fmt)
+    async for rows in batches:
+        writer.write_batch(record_batch(rows))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+def encode(rows: List[Tuple], fmt: str) -> bytes:
+    return b"".join(iter_encoded([rows], fmt))
+
+def requested_format(format: Optional[str], accept: Optional[str]) -> Optional[str]:
+    """
+    "arrow" / "parquet" from ?format= or the Accept header, else None
+    """
+    if format in MEDIA_TYPES:
+        return format
+    if format is None and accept and ARROW_STREAM_MEDIA_TYPE in accept:
+        return "arrow"
+    return None
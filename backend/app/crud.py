@@ -2,81 +2,202 @@
 CRUD operations for FP-Growth rules
 """
 from sqlalchemy.orm import Session
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncEngine
+from sqlalchemy.sql.elements import TextClause
 from sqlalchemy import text, func
+from starlette.concurrency import run_in_threadpool
 import pandas as pd
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple, Callable, Union, Iterator, AsyncIterator
 import logging
 
+from .config import settings
+from .metrics import query_function
+
 logger = logging.getLogger(__name__)
 
-def get_rules(
-    db: Session,
-    min_confidence: float = 0.0,
-    min_lift: float = 0.0,
-    min_support: float = 0.0,
-    limit: int = 100,
-    offset: int = 0
-) -> List[Dict[str, Any]]:
-    """
-    Get rules with filters
-    """
-    query = text("""
+# Tables written by `fp_growth.py --table-name` (RULES_TABLE setting)
+RULES_TABLE = settings.rules_table
+ITEMS_TABLE = f"{RULES_TABLE}_items"
+SUMMARY_TABLE = f"{RULES_TABLE}_summary"
+ITEM_FREQUENCY_TABLE = f"{RULES_TABLE}_item_frequency"
+
+def _rows(result) -> List[Dict[str, Any]]:
+    return [dict(row._mapping) for row in result]
+
+def _rules_query(
+    min_confidence: float,
+    min_lift: float,
+    min_support: float,
+    limit: int,
+    offset: int,
+    after: Optional[Tuple[float, float, int]] = None
+) -> Tuple[TextClause, Dict[str, Any]]:
+    # Keyset pagination: continue strictly after the (lift, confidence, id)
+    # of the previous page's last row, walking the index instead of skipping
+    keyset = "AND (lift, confidence, id) < (:after_lift, :after_confidence, :after_id)" if after else ""
+    query = text(f"""
         SELECT 
+            id,
             antecedent,
             consequent,
             support,
             confidence,
             lift,
             created_at
-        FROM fp_growth_rules
+        FROM {RULES_TABLE}
         WHERE confidence >= :min_confidence
           AND lift >= :min_lift
           AND support >= :min_support
-        ORDER BY lift DESC, confidence DESC
+          {keyset}
+        ORDER BY lift DESC, confidence DESC, id DESC
         LIMIT :limit OFFSET :offset
     """)
     
-    result = db.execute(
-        query,
-        {
-            "min_confidence": min_confidence,
-            "min_lift": min_lift,
-            "min_support": min_support,
-            "limit": limit,
-            "offset": offset
-        }
-    )
-    
-    return [dict(row._mapping) for row in result]
+    params = {
+        "min_confidence": min_confidence,
+        "min_lift": min_lift,
+        "min_support": min_support,
+        "limit": limit,
+        "offset": offset
+    }
+    if after:
+        params.update(zip(("after_lift", "after_confidence", "after_id"), after))
+    return query, params
 
-def get_rules_count(
+def get_rules(
     db: Session,
     min_confidence: float = 0.0,
     min_lift: float = 0.0,
-    min_support: float = 0.0
-) -> int:
+    min_support: float = 0.0,
+    limit: int = 100,
+    offset: int = 0,
+    after: Optional[Tuple[float, float, int]] = None
+) -> List[Dict[str, Any]]:
     """
-    Count total rules matching filters
+    Get rules with filters
+    `after` is the (lift, confidence, id) of the last row already returned
     """
-    query = text("""
+    result = db.execute(*_rules_query(min_confidence, min_lift, min_support, limit, offset, after))
+    return _rows(result)
+
+async def get_rules_async(
+    db: AsyncSession,
+    min_confidence: float = 0.0,
+    min_lift: float = 0.0,
+    min_support: float = 0.0,
+    limit: int = 100,
+    offset: int = 0,
+    after: Optional[Tuple[float, float, int]] = None
+) -> List[Dict[str, Any]]:
+    result = await db.execute(*_rules_query(min_confidence, min_lift, min_support, limit, offset, after))
+    return _rows(result)
+
+def get_rule_rows(
+    db: Session,
+    min_confidence: float = 0.0,
+    min_lift: float = 0.0,
+    min_support: float = 0.0,
+    limit: int = 100,
+    offset: int = 0,
+    after: Optional[Tuple[float, float, int]] = None
+) -> List[Tuple]:
+    """
+    Same page as get_rules as plain tuples (EXPORT_COLUMNS order),
+    for columnar responses that never need per-row dicts
+    """
+    result = db.execute(*_rules_query(min_confidence, min_lift, min_support, limit, offset, after))
+    return [tuple(row) for row in result]
+
+async def get_rule_rows_async(
+    db: AsyncSession,
+    min_confidence: float = 0.0,
+    min_lift: float = 0.0,
+    min_support: float = 0.0,
+    limit: int = 100,
+    offset: int = 0,
+    after: Optional[Tuple[float, float, int]] = None
+) -> List[Tuple]:
+    result = await db.execute(*_rules_query(min_confidence, min_lift, min_support, limit, offset, after))
+    return [tuple(row) for row in result]
+
+def _rules_count_query(
+    min_confidence: float,
+    min_lift: float,
+    min_support: float
+) -> Tuple[TextClause, Dict[str, Any]]:
+    query = text(f"""
         SELECT COUNT(*) as count
-        FROM fp_growth_rules
+        FROM {RULES_TABLE}
         WHERE confidence >= :min_confidence
           AND lift >= :min_lift
           AND support >= :min_support
     """)
     
-    result = db.execute(
-        query,
-        {
-            "min_confidence": min_confidence,
-            "min_lift": min_lift,
-            "min_support": min_support
-        }
-    ).first()
-    
+    return query, {
+        "min_confidence": min_confidence,
+        "min_lift": min_lift,
+        "min_support": min_support
+    }
+
+def get_rules_count(
+    db: Session,
+    min_confidence: float = 0.0,
+    min_lift: float = 0.0,
+    min_support: float = 0.0
+) -> int:
+    """
+    Count total rules matching filters
+    """
+    result = db.execute(*_rules_count_query(min_confidence, min_lift, min_support)).first()
     return result.count if result else 0
 
+async def get_rules_count_async(
+    db: AsyncSession,
+    min_confidence: float = 0.0,
+    min_lift: float = 0.0,
+    min_support: float = 0.0
+) -> int:
+    result = (await db.execute(*_rules_count_query(min_confidence, min_lift, min_support))).first()
+    return result.count if result else 0
+
+RECOMMENDATIONS_QUERY = text(f"""
+    WITH cart AS (
+        SELECT COALESCE(array_agg(item_id), '{{}}') AS item_ids
+        FROM {ITEMS_TABLE}
+        WHERE item_key = ANY(CAST(:items AS TEXT[]))
+    )
+    SELECT 
+        consequent AS item_name,
+        AVG(lift) AS score,
+        AVG(confidence) AS confidence,
+        AVG(lift) AS lift,
+        AVG(support) AS support,
+        COUNT(*) AS matched_rules
+    FROM {RULES_TABLE}
+    -- Every rule whose antecedent is a subset of the cart (GIN index)
+    WHERE antecedent_ids <@ (SELECT item_ids FROM cart)
+      AND confidence >= :min_confidence
+      AND lift >= :min_lift
+      AND NOT consequent_ids && (SELECT item_ids FROM cart)
+    GROUP BY consequent
+    ORDER BY score DESC, confidence DESC
+    LIMIT :top_n
+""")
+
+def _recommendations_query(
+    items: List[str],
+    top_n: int,
+    min_confidence: float,
+    min_lift: float
+) -> Tuple[TextClause, Dict[str, Any]]:
+    return RECOMMENDATIONS_QUERY, {
+        "items": list(dict.fromkeys(item.lower() for item in items)),
+        "min_confidence": min_confidence,
+        "min_lift": min_lift,
+        "top_n": top_n
+    }
+
 def get_recommendations(
     db: Session,
     items: List[str],
@@ -86,98 +207,188 @@ def get_recommendations(
 ) -> List[Dict[str, Any]]:
     """
     Get product recommendations based on cart items
-    Uses FP-Growth rules
+    Uses every FP-Growth rule whose antecedent items are all in the cart
     """
     if not items:
         return []
     
-    # Create placeholders for IN clause
-    items_lower = [item.lower() for item in items]
-    placeholders = ','.join([f':item{i}' for i in range(len(items))])
+    result = db.execute(*_recommendations_query(items, top_n, min_confidence, min_lift))
+    return _rows(result)
+
+async def get_recommendations_async(
+    db: AsyncSession,
+    items: List[str],
+    top_n: int = 5,
+    min_confidence: float = 0.1,
+    min_lift: float = 1.0
+) -> List[Dict[str, Any]]:
+    if not items:
+        return []
     
-    query = text(f"""
-        WITH matched_rules AS (
-            SELECT 
-                consequent,
-                support,
-                confidence,
-                lift
-            FROM fp_growth_rules
-            WHERE LOWER(antecedent) IN ({placeholders})
-              AND confidence >= :min_confidence
-              AND lift >= :min_lift
-              AND LOWER(consequent) NOT IN ({placeholders})
-        )
+    result = await db.execute(*_recommendations_query(items, top_n, min_confidence, min_lift))
+    return _rows(result)
+
+BATCH_RECOMMENDATIONS_QUERY = text(f"""
+    WITH carts AS (
+        SELECT *
+        FROM unnest(
+            CAST(:cart_ids AS INTEGER[]),
+            CAST(:top_ns AS INTEGER[]),
+            CAST(:min_confidences AS DOUBLE PRECISION[]),
+            CAST(:min_lifts AS DOUBLE PRECISION[])
+        ) AS c(cart_id, top_n, min_confidence, min_lift)
+    ),
+    cart_items AS (
+        SELECT ci.cart_id, array_agg(i.item_id) AS item_ids
+        FROM unnest(
+            CAST(:item_cart_ids AS INTEGER[]),
+            CAST(:items AS TEXT[])
+        ) AS ci(cart_id, item)
+        JOIN {ITEMS_TABLE} i ON i.item_key = ci.item
+        GROUP BY ci.cart_id
+    )
+    SELECT 
+        c.cart_id,
+        m.*
+    FROM carts c
+    JOIN cart_items ci ON ci.cart_id = c.cart_id
+    -- Per-cart top-N: each cart gets the single-cart plan (GIN subset
+    -- lookup, aggregate, top-N heapsort) inside one statement
+    CROSS JOIN LATERAL (
         SELECT 
-            consequent AS item_name,
-            AVG(lift) AS score,
-            AVG(confidence) AS confidence,
-            AVG(lift) AS lift,
-            AVG(support) AS support,
+            r.consequent AS item_name,
+            AVG(r.lift) AS score,
+            AVG(r.confidence) AS confidence,
+            AVG(r.lift) AS lift,
+            AVG(r.support) AS support,
             COUNT(*) AS matched_rules
-        FROM matched_rules
-        GROUP BY consequent
+        FROM {RULES_TABLE} r
+        WHERE r.antecedent_ids <@ ci.item_ids
+          AND r.confidence >= c.min_confidence
+          AND r.lift >= c.min_lift
+          AND NOT r.consequent_ids && ci.item_ids
+        GROUP BY r.consequent
         ORDER BY score DESC, confidence DESC
-        LIMIT :top_n
-    """)
+        LIMIT c.top_n
+    ) m
+    ORDER BY c.cart_id, m.score DESC, m.confidence DESC
+""")
+
+def _batch_recommendations_params(carts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    # Carts become parallel arrays of (cart, lower-cased item)
+    params = {
+        "cart_ids": [], "top_ns": [], "min_confidences": [], "min_lifts": [],
+        "item_cart_ids": [], "items": []
+    }
+    for cart_id, cart in enumerate(carts):
+        params["cart_ids"].append(cart_id)
+        params["top_ns"].append(cart["top_n"])
+        params["min_confidences"].append(cart["min_confidence"])
+        params["min_lifts"].append(cart["min_lift"])
+        for item in dict.fromkeys(item.lower() for item in cart["items"]):
+            params["item_cart_ids"].append(cart_id)
+            params["items"].append(item)
+    return params
+
+def _group_by_cart(result, n_carts: int) -> List[List[Dict[str, Any]]]:
+    grouped: List[List[Dict[str, Any]]] = [[] for _ in range(n_carts)]
+    for row in result:
+        row = dict(row._mapping)
+        grouped[row.pop("cart_id")].append(row)
+    return grouped
+
+def get_batch_recommendations(
+    db: Session,
+    carts: List[Dict[str, Any]]
+) -> List[List[Dict[str, Any]]]:
+    """
+    Recommendations for many carts in one round trip
+    Each cart: items, top_n, min_confidence, min_lift; results keep cart order
+    """
+    if not carts:
+        return []
     
-    # Prepare parameters
-    params = {f'item{i}': item for i, item in enumerate(items_lower)}
-    params.update({
-        'min_confidence': min_confidence,
-        'min_lift': min_lift,
-        'top_n': top_n
-    })
+    result = db.execute(BATCH_RECOMMENDATIONS_QUERY, _batch_recommendations_params(carts))
+    return _group_by_cart(result, len(carts))
+
+async def get_batch_recommendations_async(
+    db: AsyncSession,
+    carts: List[Dict[str, Any]]
+) -> List[List[Dict[str, Any]]]:
+    if not carts:
+        return []
     
-    result = db.execute(query, params)
-    return [dict(row._mapping) for row in result]
+    result = await db.execute(BATCH_RECOMMENDATIONS_QUERY, _batch_recommendations_params(carts))
+    return _group_by_cart(result, len(carts))
+
+# Precomputed by scripts/fp_growth.py when the rules are written
+STATISTICS_QUERY = text(f"""
+    SELECT 
+        total_rules,
+        total_items,
+        avg_confidence,
+        avg_lift,
+        avg_support,
+        min_confidence,
+        max_confidence,
+        min_lift,
+        max_lift,
+        created_at
+    FROM {SUMMARY_TABLE}
+""")
+
+def _statistics(result) -> Dict[str, Any]:
+    row = result.first()
+    return dict(row._mapping) if row and row.total_rules else {}
 
 def get_statistics(db: Session) -> Dict[str, Any]:
     """
     Get statistics about rules
     """
-    query = text("""
-        SELECT 
-            COUNT(*) AS total_rules,
-            COUNT(DISTINCT antecedent) + COUNT(DISTINCT consequent) AS total_items,
-            AVG(confidence) AS avg_confidence,
-            AVG(lift) AS avg_lift,
-            AVG(support) AS avg_support,
-            MIN(confidence) AS min_confidence,
-            MAX(confidence) AS max_confidence,
-            MIN(lift) AS min_lift,
-            MAX(lift) AS max_lift
-        FROM fp_growth_rules
-    """)
-    
-    result = db.execute(query).first()
-    
-    if not result:
-        return {}
-    
-    return dict(result._mapping)
+    return _statistics(db.execute(STATISTICS_QUERY))
+
+async def get_statistics_async(db: AsyncSession) -> Dict[str, Any]:
+    return _statistics(await db.execute(STATISTICS_QUERY))
+
+TOP_ITEMS_QUERY = text(f"""
+    SELECT 
+        item_name,
+        frequency,
+        antecedent_rules,
+        consequent_rules
+    FROM {ITEM_FREQUENCY_TABLE}
+    ORDER BY frequency DESC, item_name
+    LIMIT :limit
+""")
 
 def get_top_items(db: Session, limit: int = 20) -> List[Dict[str, Any]]:
     """
-    Get top items by frequency in rules
+    Get top items by number of rules they appear in
     """
-    query = text("""
-        WITH all_items AS (
-            SELECT antecedent AS item_name FROM fp_growth_rules
-            UNION ALL
-            SELECT consequent FROM fp_growth_rules
-        )
-        SELECT 
-            item_name,
-            COUNT(*) AS frequency
-        FROM all_items
-        GROUP BY item_name
-        ORDER BY frequency DESC
-        LIMIT :limit
-    """)
-    
-    result = db.execute(query, {"limit": limit})
-    return [dict(row._mapping) for row in result]
+    return _rows(db.execute(TOP_ITEMS_QUERY, {"limit": limit}))
+
+async def get_top_items_async(db: AsyncSession, limit: int = 20) -> List[Dict[str, Any]]:
+    return _rows(await db.execute(TOP_ITEMS_QUERY, {"limit": limit}))
+
+SEARCH_QUERY = text(f"""
+    WITH matched_items AS (
+        SELECT COALESCE(array_agg(item_id), '{{}}') AS item_ids
+        FROM {ITEMS_TABLE}
+        WHERE item_key LIKE :pattern
+    )
+    SELECT 
+        antecedent,
+        consequent,
+        support,
+        confidence,
+        lift
+    FROM {RULES_TABLE}
+    -- Rules with a matching item on either side (GIN indexes)
+    WHERE antecedent_ids && (SELECT item_ids FROM matched_items)
+       OR consequent_ids && (SELECT item_ids FROM matched_items)
+    ORDER BY lift DESC
+    LIMIT :limit
+""")
 
 def search_rules_by_item(
     db: Session,
@@ -187,26 +398,94 @@ def search_rules_by_item(
     """
     Search rules containing specific item
     """
-    query = text("""
-        SELECT 
-            antecedent,
-            consequent,
-            support,
-            confidence,
-            lift
-        FROM fp_growth_rules
-        WHERE LOWER(antecedent) LIKE LOWER(:pattern)
-           OR LOWER(consequent) LIKE LOWER(:pattern)
-        ORDER BY lift DESC
-        LIMIT :limit
-    """)
-    
-    result = db.execute(
-        query,
-        {
-            "pattern": f"%{item_name}%",
-            "limit": limit
-        }
-    )
-    
-    return [dict(row._mapping) for row in result]
\ No newline at end of file
+    result = db.execute(SEARCH_QUERY, {"pattern": f"%{item_name.lower()}%", "limit": limit})
+    return _rows(result)
+
+async def search_rules_by_item_async(
+    db: AsyncSession,
+    item_name: str,
+    limit: int = 50
+) -> List[Dict[str, Any]]:
+    result = await db.execute(SEARCH_QUERY, {"pattern": f"%{item_name.lower()}%", "limit": limit})
+    return _rows(result)
+
+EXPORT_COLUMNS = ["id", "antecedent", "consequent", "support", "confidence", "lift", "created_at"]
+
+EXPORT_QUERY = text(f"""
+    SELECT 
+        id,
+        antecedent,
+        consequent,
+        support,
+        confidence,
+        lift,
+        created_at
+    FROM {RULES_TABLE}
+    WHERE confidence >= :min_confidence
+      AND lift >= :min_lift
+      AND support >= :min_support
+    ORDER BY lift DESC, confidence DESC, id DESC
+""")
+
+def stream_rules(
+    engine: Engine,
+    min_confidence: float = 0.0,
+    min_lift: float = 0.0,
+    min_support: float = 0.0,
+    batch_size: int = 10000
+) -> Iterator[List[Tuple]]:
+    """
+    Yield all matching rules in batches from a server-side cursor
+
+    Opens its own connection: the generator outlives the request handler
+    (and its session) while the response streams.
+    """
+    params = {"min_confidence": min_confidence, "min_lift": min_lift, "min_support": min_support}
+    with engine.connect() as conn:
+        with query_function("stream_rules"):
+            result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(
+                EXPORT_QUERY, params
+            )
+        for batch in result.partitions(batch_size):
+            yield [tuple(row) for row in batch]
+
+async def stream_rules_async(
+    engine: AsyncEngine,
+    min_confidence: float = 0.0,
+    min_lift: float = 0.0,
+    min_support: float = 0.0,
+    batch_size: int = 10000
+) -> AsyncIterator[List[Tuple]]:
+    params = {"min_confidence": min_confidence, "min_lift": min_lift, "min_support": min_support}
+    async with engine.connect() as conn:
+        with query_function("stream_rules"):
+            result = await conn.stream(
+                EXPORT_QUERY, params, execution_options={"yield_per": batch_size}
+            )
+        async for batch in result.partitions(batch_size):
+            yield [tuple(row) for row in batch]
+
+# Async counterparts, used by run() when the session is an AsyncSession
+ASYNC_VERSIONS: Dict[Callable, Callable] = {
+    get_rules: get_rules_async,
+    get_rule_rows: get_rule_rows_async,
+    get_rules_count: get_rules_count_async,
+    get_recommendations: get_recommendations_async,
+    get_batch_recommendations: get_batch_recommendations_async,
+    get_statistics: get_statistics_async,
+    get_top_items: get_top_items_async,
+    search_rules_by_item: search_rules_by_item_async,
+}
+
+async def run(func: Callable, db: Union[Session, AsyncSession], **kwargs) -> Any:
+    """
+    Call a crud function from an async handler
+
+    AsyncSession runs the native async version on the event loop;
+    a sync Session runs the function in the threadpool as before
+    """
+    # Label the SQL for /metrics; the context is copied into the threadpool
+    with query_function(func.__name__):
+        if isinstance(db, AsyncSession):
+            return await ASYNC_VERSIONS[func](db, **kwargs)
+        return await run_in_threadpool(func, db, **kwargs)
\ No newline at end of file
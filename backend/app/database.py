@@ -1,25 +1,151 @@
 """
 Database connection and session management
 """
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, exc
 from sqlalchemy.orm import sessionmaker, Session
-from sqlalchemy.pool import StaticPool
-from typing import Generator
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine
+)
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.util.queue import Queue, AsyncAdaptedQueue
+from typing import Generator, AsyncGenerator, Dict, Any, Optional, Union
+import threading
+import time
 import logging
 from .config import settings
+from .metrics import registry, db_pool_wait, instrument_engine
 
 logger = logging.getLogger(__name__)
 
+class TimedQueueMixin:
+    """
+    Times get() on the pool's queue of idle connections, i.e. how long a
+    checkout waits for a connection to be returned. Opening new connections
+    and the pre-ping happen outside get() and are not included.
+    """
+    on_wait = None
+
+    def get(self, block=True, timeout=None):
+        start = time.perf_counter()
+        try:
+            return super().get(block, timeout)
+        finally:
+            if self.on_wait is not None:
+                self.on_wait(time.perf_counter() - start)
+
+class TimedQueue(TimedQueueMixin, Queue):
+    pass
+
+class TimedAsyncAdaptedQueue(TimedQueueMixin, AsyncAdaptedQueue):
+    pass
+
+class WaitTimingMixin:
+    """
+    Records checkouts, pool timeouts and how long callers wait in the
+    pool queue for an idle connection
+    """
+    metrics_label = "sync"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self._pool.on_wait = self._record_wait
+
+    def _record_wait(self, waited: float):
+        with self._stats_lock:
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        db_pool_wait.observe(waited, pool=self.metrics_label)
+
+    def connect(self):
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            with self._stats_lock:
+                self.checkouts += 1
+
+class TimedQueuePool(WaitTimingMixin, QueuePool):
+    _queue_class = TimedQueue
+
+class TimedAsyncQueuePool(WaitTimingMixin, AsyncAdaptedQueuePool):
+    _queue_class = TimedAsyncAdaptedQueue
+    metrics_label = "async"
+
+# SQLAlchemy names pool loggers after the class module; keep them at the
+# library's default verbosity instead of inheriting the app's INFO level
+for _pool_class in (TimedQueuePool, TimedAsyncQueuePool):
+    logging.getLogger(f"{__name__}.{_pool_class.__name__}").setLevel(logging.WARNING)
+
+def _pool_options() -> Dict[str, Any]:
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+    }
+
 # Create engine
 engine = create_engine(
     settings.database_url,
-    poolclass=StaticPool,
-    echo=False  # Set True for SQL debugging
+    poolclass=TimedQueuePool,
+    echo=False,  # Set True for SQL debugging
+    **_pool_options()
 )
 
+instrument_engine(engine)
+
 # Session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+def get_async_database_url() -> Union[str, URL]:
+    """
+    Async URL: ASYNC_DATABASE_URL, or DATABASE_URL with the asyncpg driver
+    """
+    if settings.async_database_url:
+        return settings.async_database_url
+    url = make_url(settings.database_url)
+    if url.get_backend_name() != "postgresql":
+        raise ValueError(f"Async database path needs PostgreSQL, got {url.get_backend_name()}")
+    # libpq-style ?host=/socket/dir is not understood by asyncpg
+    query = dict(url.query)
+    host = query.pop("host", None)
+    return url.set(
+        drivername="postgresql+asyncpg",
+        host=url.host or host,
+        query=query
+    )
+
+# Async engine (asyncpg), only created when enabled so asyncpg stays optional
+async_engine: Optional[AsyncEngine] = None
+AsyncSessionLocal: Optional[async_sessionmaker] = None
+
+if settings.use_async_db:
+    async_engine = create_async_engine(
+        get_async_database_url(),
+        poolclass=TimedAsyncQueuePool,
+        echo=False,
+        **_pool_options()
+    )
+    instrument_engine(async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(
+        async_engine,
+        autoflush=False,
+        expire_on_commit=False
+    )
+
 def get_db() -> Generator[Session, None, None]:
     """
     Dependency to get database session
@@ -30,6 +156,16 @@ def get_db() -> Generator[Session, None, None]:
     finally:
         db.close()
 
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Dependency to get async database session
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Session dependency used by the routers
+get_session = get_async_db if settings.use_async_db else get_db
+
 def test_connection() -> bool:
     """
     Test database connection
@@ -41,4 +177,50 @@ def test_connection() -> bool:
         return True
     except Exception as e:
         logger.error(f"✗ Database connection failed: {e}")
-        return False
\ No newline at end of file
+        return False
+
+def get_pool_stats() -> Dict[str, Any]:
+    """
+    Connection pool usage, for sizing the pool against traffic
+
+    Reports the pool serving API requests (async engine when enabled)
+    """
+    pool = async_engine.pool if async_engine is not None else engine.pool
+    stats = {
+        "pool_size": pool.size(),
+        "max_overflow": settings.db_max_overflow,
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+    }
+    if isinstance(pool, WaitTimingMixin):
+        with pool._stats_lock:
+            checkouts = pool.checkouts
+            stats.update({
+                "checkouts": checkouts,
+                "timeouts": pool.timeouts,
+                "wait_seconds_total": round(pool.wait_seconds_total, 6),
+                "wait_seconds_avg": round(pool.wait_seconds_total / checkouts, 6) if checkouts else 0.0,
+                "wait_seconds_max": round(pool.wait_seconds_max, 6),
+            })
+    return stats
+
+def _pool_samples():
+    stats = get_pool_stats()
+    return [
+        ({"state": state}, stats[state])
+        for state in ("checked_out", "checked_in", "overflow")
+    ]
+
+registry.callback(
+    "mba_db_pool_connections",
+    "Connections in the API pool by state",
+    "gauge",
+    _pool_samples
+)
+registry.callback(
+    "mba_db_pool_timeouts_total",
+    "Checkouts that hit pool_timeout",
+    "counter",
+    lambda: [({}, get_pool_stats().get("timeouts", 0))]
+)
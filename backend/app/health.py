@@ -0,0 +1,110 @@
+"""
+Background database health monitor
+"""
+from sqlalchemy import text
+from typing import Dict, Any, Optional
+from datetime import datetime
+import threading
+import time
+import logging
+
+from .config import settings
+from .database import engine
+from .rule_index import rule_index
+from .metrics import query_function
+
+logger = logging.getLogger(__name__)
+
+def _age_seconds(moment: Optional[datetime]) -> Optional[float]:
+    if moment is None:
+        return None
+    return round((datetime.now(moment.tzinfo) - moment).total_seconds(), 3)
+
+class HealthMonitor:
+    """
+    Runs SELECT 1 on an interval and keeps the outcome, so probes read
+    the last result instead of opening a connection each time
+    """
+
+    def __init__(self, check_interval: float):
+        self.check_interval = check_interval
+        self.database_ok: Optional[bool] = None
+        self.latency_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.checked_at: Optional[datetime] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def check(self) -> bool:
+        """
+        Probe the database once and record latency; logs only on state changes
+        """
+        start = time.perf_counter()
+        try:
+            with query_function("health_check"), engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+            ok, error = True, None
+        except Exception as e:
+            ok, error = False, str(e)
+        latency_ms = (time.perf_counter() - start) * 1000
+
+        if ok and self.database_ok is not True:
+            logger.info(f"✓ Database connection established ({latency_ms:.1f} ms)")
+        elif not ok and self.database_ok is not False:
+            logger.error(f"✗ Database connection failed: {error}")
+
+        self.database_ok, self.latency_ms, self.last_error = ok, round(latency_ms, 3), error
+        self.checked_at = datetime.now()
+        return ok
+
+    def liveness(self) -> Dict[str, Any]:
+        return {
+            "status": "alive",
+            "timestamp": datetime.now(),
+            "monitor_running": self._thread is not None and self._thread.is_alive()
+        }
+
+    def readiness(self) -> Dict[str, Any]:
+        """
+        Cached readiness: database reachable at the last check and a rule
+        set (plus the in-memory index, when enabled) loaded
+        """
+        rule_set_loaded = rule_index.version is not None
+        index_ready = rule_index.is_loaded() or not rule_index.build_index
+        ready = bool(self.database_ok) and rule_set_loaded and index_ready
+        return {
+            "status": "ready" if ready else "not_ready",
+            "database": "connected" if self.database_ok else "disconnected",
+            "database_latency_ms": self.latency_ms,
+            "database_error": self.last_error,
+            "checked_at": self.checked_at,
+            "check_age_seconds": _age_seconds(self.checked_at),
+            "rule_set_loaded": rule_set_loaded,
+            "rule_set_version": rule_index.version,
+            "rule_set_age_seconds": _age_seconds(rule_index.version),
+            "rule_index_enabled": rule_index.build_index,
+            "rule_index_loaded": rule_index.is_loaded(),
+            "rule_index_loaded_at": rule_index.loaded_at,
+            "rule_index_age_seconds": _age_seconds(rule_index.loaded_at),
+            "timestamp": datetime.now()
+        }
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            self.check()
+
+    def start(self):
+        """
+        Check once, then keep checking in a background thread
+        """
+        self.check()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="health-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+health_monitor = HealthMonitor(settings.health_check_interval)
@@ -1,16 +1,24 @@
 """
 FastAPI application entry point
 """
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from datetime import datetime
+from typing import Dict
 import logging
 
 from .config import settings
-from .database import test_connection
-from .routers import rules, recommendations
-from .models import HealthResponse
+from .database import get_pool_stats, async_engine
+from .rule_index import rule_index
+from .health import health_monitor
+from .profiling import slow_query_log
+from .cache import recommendation_cache, rule_count_cache
+from .metrics import registry, MetricsMiddleware, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from .routers import rules, recommendations, admin
+from .models import (
+    HealthResponse, LivenessResponse, ReadinessResponse, PoolStatsResponse, CacheStatsResponse
+)
 
 # Configure logging
 logging.basicConfig(
@@ -50,9 +58,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency histograms for /metrics
+app.add_middleware(MetricsMiddleware)
+
 # Include routers
 app.include_router(rules.router)
 app.include_router(recommendations.router)
+if settings.enable_admin_endpoints:
+    app.include_router(admin.router)
 
 # Root endpoint
 @app.get("/", tags=["Root"])
@@ -71,9 +84,9 @@ def root():
 @app.get("/health", response_model=HealthResponse, tags=["Health"])
 def health_check():
     """
-    Health check endpoint
+    Health check endpoint (last background check, no database round trip)
     """
-    db_status = "connected" if test_connection() else "disconnected"
+    db_status = "connected" if health_monitor.database_ok else "disconnected"
     
     return HealthResponse(
         status="healthy" if db_status == "connected" else "unhealthy",
@@ -81,6 +94,53 @@ def health_check():
         timestamp=datetime.now()
     )
 
+# Liveness probe
+@app.get("/health/live", response_model=LivenessResponse, tags=["Health"])
+def liveness():
+    """
+    The process is up and serving; never touches the database
+    """
+    return LivenessResponse(**health_monitor.liveness())
+
+# Readiness probe
+@app.get("/health/ready", response_model=ReadinessResponse, tags=["Health"])
+def readiness(response: Response):
+    """
+    Cached database state and rule set / index age; 503 until ready
+    """
+    state = health_monitor.readiness()
+    if state["status"] != "ready":
+        response.status_code = 503
+    return ReadinessResponse(**state)
+
+# Connection pool statistics
+@app.get("/health/pool", response_model=PoolStatsResponse, tags=["Health"])
+def pool_stats():
+    """
+    Connection pool usage and checkout wait times
+    """
+    return PoolStatsResponse(**get_pool_stats())
+
+# Result cache statistics
+@app.get("/health/cache", response_model=Dict[str, CacheStatsResponse], tags=["Health"])
+def cache_stats():
+    """
+    Size and hit/miss counters of the recommendation and rule count caches
+    """
+    return {
+        "recommendations": CacheStatsResponse(**recommendation_cache.stats()),
+        "rule_counts": CacheStatsResponse(**rule_count_cache.stats())
+    }
+
+# Prometheus metrics
+@app.get("/metrics", response_class=PlainTextResponse, tags=["Health"])
+def metrics():
+    """
+    Request latency, SQL time per crud function, pool waits and cache
+    hit ratios in Prometheus text format
+    """
+    return PlainTextResponse(registry.exposition(), media_type=METRICS_CONTENT_TYPE)
+
 # Startup event
 @app.on_event("startup")
 async def startup_event():
@@ -89,11 +149,15 @@ async def startup_event():
     """
     logger.info(f"Starting {settings.api_title} v{settings.api_version}")
     
-    # Test database connection
-    if test_connection():
-        logger.info("✓ Database connection established")
-    else:
-        logger.error("✗ Database connection failed")
+    # Check the database now and then on an interval; probes read the result
+    health_monitor.start()
+    slow_query_log.start()
+    
+    # Track the rule set version in the background: the in-memory index is
+    # rebuilt and the result caches dropped when new rules land
+    rule_index.add_listener(recommendation_cache.invalidate)
+    rule_index.add_listener(rule_count_cache.invalidate)
+    rule_index.start()
 
 # Shutdown event
 @app.on_event("shutdown")
@@ -102,6 +166,11 @@ async def shutdown_event():
     Execute on application shutdown
     """
     logger.info("Shutting down API")
+    rule_index.stop()
+    health_monitor.stop()
+    slow_query_log.stop()
+    if async_engine is not None:
+        await async_engine.dispose()
 
 # Exception handlers
 @app.exception_handler(Exception)
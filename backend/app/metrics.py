@@ -0,0 +1,228 @@
+"""
+In-process metrics registry with Prometheus text exposition
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from typing import List, Dict, Any, Tuple, Callable, Iterator, Sequence
+import bisect
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4"  # Starlette appends the charset
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 100000)
+
+Sample = Tuple[str, Dict[str, str], float]
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(str(value))}"' for key, value in labels.items()) + "}"
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """
+    Base class: a named family of samples keyed by label values
+    """
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def samples(self) -> List[Sample]:
+        raise NotImplementedError
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = REQUEST_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (non-cumulative, last is +Inf), sum]
+        self._values: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+
+        samples = []
+        for key, counts, total in values:
+            labels = dict(zip(self.label_names, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(float(bound))}, cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, cumulative))
+        return samples
+
+class CallbackMetric(Metric):
+    """
+    Values read from existing stats at scrape time (pool, caches)
+    """
+
+    def __init__(self, name: str, help: str, type: str, collect: Callable[[], List[Tuple[Dict[str, str], float]]]):
+        super().__init__(name, help)
+        self.type = type
+        self._collect = collect
+
+    def samples(self) -> List[Sample]:
+        return [(self.name, labels, value) for labels, value in self._collect()]
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = REQUEST_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def callback(self, name: str, help: str, type: str, collect: Callable) -> CallbackMetric:
+        return self.register(CallbackMetric(name, help, type, collect))
+
+    def exposition(self) -> str:
+        """
+        Prometheus text format (0.0.4)
+        """
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                logger.error(f"✗ Collecting {metric.name} failed: {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+http_request_duration = registry.histogram(
+    "mba_http_request_duration_seconds",
+    "HTTP request latency by route template and status",
+    labels=("method", "route", "status")
+)
+db_query_duration = registry.histogram(
+    "mba_db_query_duration_seconds",
+    "SQL execution time by crud function",
+    labels=("function",),
+    buckets=QUERY_BUCKETS
+)
+db_query_rows = registry.histogram(
+    "mba_db_query_rows",
+    "Rows returned per SQL statement by crud function",
+    labels=("function",),
+    buckets=ROW_BUCKETS
+)
+db_pool_wait = registry.histogram(
+    "mba_db_pool_wait_seconds",
+    "Time checkouts wait for an idle pooled connection (excludes connecting and pre-ping)",
+    labels=("pool",),
+    buckets=QUERY_BUCKETS
+)
+
+# Name of the crud function whose SQL is running (set by crud.run and friends)
+_query_function: ContextVar[str] = ContextVar("query_function", default="other")
+
+def current_query_function() -> str:
+    return _query_function.get()
+
+@contextmanager
+def query_function(name: str) -> Iterator[None]:
+    """
+    Attribute SQL executed inside the block to `name`
+    """
+    token = _query_function.set(name)
+    try:
+        yield
+    finally:
+        _query_function.reset(token)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_start = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_metrics_start", None)
+    if start is None:
+        return
+    function = _query_function.get()
+    db_query_duration.observe(time.perf_counter() - start, function=function)
+    # Server-side cursors report -1 until fetched
+    if cursor.rowcount is not None and cursor.rowcount >= 0:
+        db_query_rows.observe(cursor.rowcount, function=function)
+
+def instrument_engine(sync_engine):
+    """
+    Time every statement on a (sync) Engine; pass async_engine.sync_engine
+    for the asyncpg engine
+    """
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing each request up to the last body chunk, so
+    streamed responses are measured in full. Routes are labelled by their
+    template (/rules/{id}, not /rules/42) to keep cardinality bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            http_request_duration.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=status["code"]
+            )
@@ -2,7 +2,7 @@
 Pydantic models for request/response validation
 """
 from pydantic import BaseModel, Field, validator
-from typing import List, Optional
+from typing import List, Optional, Any
 from datetime import datetime
 
 # ============= Rules Models =============
@@ -15,6 +15,7 @@ class RuleBase(BaseModel):
     lift: float
 
 class Rule(RuleBase):
+    id: Optional[int] = None
     created_at: Optional[datetime] = None
     
     class Config:
@@ -23,6 +24,7 @@ class Rule(RuleBase):
 class RulesResponse(BaseModel):
     total: int
     rules: List[Rule]
+    next_cursor: Optional[str] = Field(None, description="Pass as ?cursor= to fetch the next page")
 
 # ============= Recommendation Models =============
 
@@ -55,7 +57,7 @@ class RecommendationResponse(BaseModel):
 
 class StatsResponse(BaseModel):
     total_rules: int
-    total_items: int
+    total_items: int = Field(..., description="Distinct items across antecedents and consequents")
     avg_confidence: float
     avg_lift: float
     avg_support: float
@@ -63,8 +65,63 @@ class StatsResponse(BaseModel):
     max_confidence: float
     min_lift: float
     max_lift: float
+    created_at: Optional[datetime] = None
 
 class HealthResponse(BaseModel):
     status: str
     database: str
-    timestamp: datetime
\ No newline at end of file
+    timestamp: datetime
+
+class LivenessResponse(BaseModel):
+    status: str
+    timestamp: datetime
+    monitor_running: bool
+
+class ReadinessResponse(BaseModel):
+    status: str = Field(..., description="ready or not_ready")
+    database: str
+    database_latency_ms: Optional[float] = Field(None, description="SELECT 1 round trip at the last check")
+    database_error: Optional[str] = None
+    checked_at: Optional[datetime] = None
+    check_age_seconds: Optional[float] = None
+    rule_set_loaded: bool
+    rule_set_version: Optional[datetime] = Field(None, description="MAX(created_at) of the rules table")
+    rule_set_age_seconds: Optional[float] = None
+    rule_index_enabled: bool
+    rule_index_loaded: bool
+    rule_index_loaded_at: Optional[datetime] = None
+    rule_index_age_seconds: Optional[float] = None
+    timestamp: datetime
+
+class SlowQueryResponse(BaseModel):
+    function: str = Field(..., description="crud function that ran the query")
+    duration_ms: float
+    captured_at: datetime
+    statement: str
+    parameters: Optional[Any] = None
+    plan: Optional[List[str]] = Field(None, description="EXPLAIN (ANALYZE, BUFFERS) output")
+    explain_error: Optional[str] = None
+
+class PoolStatsResponse(BaseModel):
+    pool_size: int
+    max_overflow: int
+    checked_out: int = Field(..., description="Connections currently in use")
+    checked_in: int = Field(..., description="Idle connections in the pool")
+    overflow: int = Field(..., description="Connections opened beyond pool_size")
+    checkouts: int = 0
+    timeouts: int = Field(0, description="Checkouts that hit pool_timeout")
+    wait_seconds_total: float = 0.0
+    wait_seconds_avg: float = 0.0
+    wait_seconds_max: float = 0.0
+
+class CacheStatsResponse(BaseModel):
+    enabled: bool
+    size: int
+    maxsize: int
+    ttl: float
+    hits: int
+    misses: int
+    hit_ratio: float
+    evictions: int
+    invalidations: int = Field(..., description="Times the cache was dropped for a new rule set")
+    version: Optional[datetime] = Field(None, description="Rule set version (latest created_at)")
@@ -0,0 +1,261 @@
+"""
+Opt-in per-request profiling and slow-query capture
+"""
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from contextvars import ContextVar
+from typing import List, Dict, Any, Optional, Callable
+from datetime import datetime
+import asyncio
+import functools
+import heapq
+import itertools
+import queue
+import re
+import threading
+import time
+import logging
+
+from .config import settings
+from .database import engine, async_engine
+from .metrics import query_function, current_query_function
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Profile"
+
+class RequestProfile:
+    """
+    Timing breakdown for one request, reported as a Server-Timing header
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.endpoint_start: Optional[float] = None
+        self.endpoint_end: Optional[float] = None
+        self.db_seconds = 0.0
+        self.db_queries = 0
+
+    def server_timing(self, end: float) -> str:
+        endpoint_start = self.endpoint_start or end
+        endpoint_end = self.endpoint_end or end
+        parts = [
+            ("validate", endpoint_start - self.start, "request parsing and dependencies"),
+            ("handler", endpoint_end - endpoint_start, "endpoint, including db"),
+            ("db", self.db_seconds, f"{self.db_queries} queries"),
+            ("serialize", end - endpoint_end, "response model and JSON encoding"),
+            ("total", end - self.start, None),
+        ]
+        return ", ".join(
+            f"{name};dur={seconds * 1000:.3f}" + (f';desc="{desc}"' if desc else "")
+            for name, seconds, desc in parts
+        )
+
+_profile: ContextVar[Optional[RequestProfile]] = ContextVar("request_profile", default=None)
+
+def _profiling_requested(request: Request) -> bool:
+    return settings.profiling_enabled or request.headers.get(PROFILE_HEADER, "").lower() in ("1", "true", "yes")
+
+def _timed_endpoint(call: Callable) -> Callable:
+    """
+    Wrap the endpoint so the handler time can be split from the work
+    FastAPI does around it (validation before, serialization after)
+    """
+    if asyncio.iscoroutinefunction(call):
+        @functools.wraps(call)
+        async def endpoint(*args, **kwargs):
+            profile = _profile.get()
+            if profile is None:
+                return await call(*args, **kwargs)
+            profile.endpoint_start = time.perf_counter()
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                profile.endpoint_end = time.perf_counter()
+    else:
+        @functools.wraps(call)
+        def endpoint(*args, **kwargs):
+            profile = _profile.get()
+            if profile is None:
+                return call(*args, **kwargs)
+            profile.endpoint_start = time.perf_counter()
+            try:
+                return call(*args, **kwargs)
+            finally:
+                profile.endpoint_end = time.perf_counter()
+    return endpoint
+
+class ProfiledRoute(APIRoute):
+    """
+    Route class that adds a Server-Timing breakdown (validate, handler, db,
+    serialize, total) when the request sends `X-Profile: 1` or
+    PROFILING_ENABLED is set. Streamed bodies are not included.
+    """
+
+    def get_route_handler(self) -> Callable:
+        self.dependant.call = _timed_endpoint(self.dependant.call)
+        handler = super().get_route_handler()
+
+        async def profiled_handler(request: Request) -> Response:
+            if not _profiling_requested(request):
+                return await handler(request)
+            profile = RequestProfile()
+            token = _profile.set(profile)
+            try:
+                response = await handler(request)
+            finally:
+                _profile.reset(token)
+            response.headers["Server-Timing"] = profile.server_timing(time.perf_counter())
+            return response
+
+        return profiled_handler
+
+class SlowQueryLog:
+    """
+    Keeps the slowest `size` crud queries over the threshold, optionally
+    with an EXPLAIN (ANALYZE, BUFFERS) plan captured in a background thread.
+    Bound parameters are kept for EXPLAIN but redacted from entries()
+    unless `parameters` is set.
+    """
+
+    # SQL attributed to these labels is not crud work
+    IGNORED_FUNCTIONS = {"other", "health_check", "rule_index_version", "rule_index_reload", "slow_query_explain"}
+
+    def __init__(self, threshold_ms: float, size: int, explain: bool = False, parameters: bool = False):
+        self.threshold_ms = threshold_ms
+        self.size = size
+        self.explain = explain
+        self.parameters = parameters
+        self._entries: List[Any] = []  # min-heap of (duration_ms, seq, entry)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=100)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_ms > 0 and self.size > 0
+
+    def _admits(self, duration_ms: float) -> bool:
+        return len(self._entries) < self.size or duration_ms > self._entries[0][0]
+
+    def record(self, function: str, statement: str, parameters: Any, duration_ms: float):
+        """
+        Called for every statement; cheap unless the query is slow
+        """
+        if duration_ms < self.threshold_ms or function in self.IGNORED_FUNCTIONS:
+            return
+        if not statement.lstrip().upper().startswith(("SELECT", "WITH")):
+            return  # EXPLAIN ANALYZE executes the statement: reads only
+        with self._lock:
+            if not self._admits(duration_ms):
+                return
+
+        entry = {
+            "function": function,
+            "duration_ms": round(duration_ms, 3),
+            "captured_at": datetime.now(),
+            "statement": statement.strip(),
+            "parameters": parameters,
+            "plan": None,
+            "explain_error": None,
+        }
+        logger.warning(f"✗ Slow query in {function}: {duration_ms:.1f} ms")
+        if self.explain:
+            try:
+                self._queue.put_nowait(entry)
+                return
+            except queue.Full:
+                entry["explain_error"] = "explain queue full"
+        self._add(entry)
+
+    def _add(self, entry: Dict[str, Any]):
+        with self._lock:
+            item = (entry["duration_ms"], next(self._seq), entry)
+            if len(self._entries) < self.size:
+                heapq.heappush(self._entries, item)
+            elif self._admits(entry["duration_ms"]):
+                heapq.heapreplace(self._entries, item)
+
+    def _explain(self, entry: Dict[str, Any]):
+        statement, parameters = _pyformat(entry["statement"], entry["parameters"])
+        try:
+            with query_function("slow_query_explain"), engine.connect() as conn:
+                entry["plan"] = conn.exec_driver_sql(
+                    f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters
+                ).scalars().all()
+                conn.rollback()
+        except Exception as e:
+            entry["explain_error"] = str(e)
+
+    def _run(self):
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                return
+            self._explain(entry)
+            self._add(entry)
+
+    def start(self):
+        if self.enabled and self.explain and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="slow-query-explain", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """
+        Captured queries, slowest first
+        """
+        with self._lock:
+            entries = [entry for _, _, entry in sorted(self._entries, reverse=True)]
+        if self.parameters:
+            return entries
+        return [{**entry, "parameters": None} for entry in entries]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+def _pyformat(statement: str, parameters: Any):
+    """
+    asyncpg statements use $1..$n; rewrite them for the psycopg2 engine
+    """
+    if parameters is None or isinstance(parameters, dict):
+        return statement, parameters
+    statement = re.sub(r"\$(\d+)", lambda m: f"%(p{m.group(1)})s", statement.replace("%", "%%"))
+    return statement, {f"p{i}": value for i, value in enumerate(parameters, start=1)}
+
+slow_query_log = SlowQueryLog(
+    settings.slow_query_threshold_ms,
+    settings.slow_query_log_size,
+    explain=settings.slow_query_explain,
+    parameters=settings.slow_query_parameters
+)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._profiling_start = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_profiling_start", None)
+    if start is None or executemany:
+        return
+    seconds = time.perf_counter() - start
+
+    profile = _profile.get()
+    if profile is not None:
+        profile.db_seconds += seconds
+        profile.db_queries += 1
+
+    if slow_query_log.enabled:
+        slow_query_log.record(current_query_function(), statement, parameters, seconds * 1000)
+
+for _engine in (engine, async_engine.sync_engine if async_engine is not None else None):
+    if _engine is not None:
+        event.listen(_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(_engine, "after_cursor_execute", _after_cursor_execute)
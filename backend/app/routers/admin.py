@@ -0,0 +1,25 @@
+"""
+Admin endpoints
+"""
+from fastapi import APIRouter
+from typing import List
+from ..models import SlowQueryResponse
+from ..profiling import slow_query_log
+
+router = APIRouter(prefix="/admin", tags=["Admin"])
+
+@router.get("/slow-queries", response_model=List[SlowQueryResponse])
+def get_slow_queries():
+    """
+    Slowest crud queries over SLOW_QUERY_THRESHOLD_MS, slowest first, with
+    their EXPLAIN (ANALYZE, BUFFERS) plans when SLOW_QUERY_EXPLAIN is set
+    """
+    return slow_query_log.entries()
+
+@router.delete("/slow-queries")
+def clear_slow_queries():
+    """
+    Empty the slow query log
+    """
+    slow_query_log.clear()
+    return {"cleared": True}
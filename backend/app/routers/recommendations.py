@@ -3,20 +3,70 @@ Recommendation API endpoints
 """
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from ..database import get_db
+from starlette.concurrency import run_in_threadpool
+from ..database import get_session
 from ..models import (
     RecommendationRequest, 
     RecommendationResponse,
     RecommendedItem
 )
 from .. import crud
+from ..config import settings
+from ..rule_index import rule_index
+from ..cache import recommendation_cache, recommendation_key
+from ..profiling import ProfiledRoute
 
-router = APIRouter(prefix="/recommend", tags=["Recommendations"])
+router = APIRouter(prefix="/recommend", tags=["Recommendations"], route_class=ProfiledRoute)
+
+# Carts scored per threadpool call for batches: index scoring is CPU-bound
+# numpy work, so it runs off the event loop in bounded slices
+SCORE_CHUNK_SIZE = 500
+
+def _score_carts(index, carts: list[RecommendationRequest]) -> list[list[dict]]:
+    return [
+        index.recommend(cart.items, cart.top_n, cart.min_confidence, cart.min_lift)
+        for cart in carts
+    ]
+
+async def score_recommendations(
+    db: Session,
+    items: list[str],
+    top_n: int,
+    min_confidence: float,
+    min_lift: float
+) -> list[dict]:
+    """
+    Score from the cache, then the in-memory rule index when loaded,
+    otherwise query the database
+    """
+    if recommendation_cache.enabled:
+        key = recommendation_key(items, top_n, min_confidence, min_lift)
+        version = recommendation_cache.version
+        cached = recommendation_cache.get(key)
+        if cached is not None:
+            return cached
+    
+    index = rule_index.index if settings.use_rule_index else None
+    if index is not None:
+        recommendations = await run_in_threadpool(index.recommend, items, top_n, min_confidence, min_lift)
+    else:
+        recommendations = await crud.run(
+            crud.get_recommendations,
+            db=db,
+            items=items,
+            top_n=top_n,
+            min_confidence=min_confidence,
+            min_lift=min_lift
+        )
+    
+    if recommendation_cache.enabled:
+        recommendation_cache.put(key, recommendations, version)
+    return recommendations
 
 @router.post("/", response_model=RecommendationResponse)
-def get_recommendations(
+async def get_recommendations(
     request: RecommendationRequest,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_session)
 ):
     """
     Get product recommendations based on items in cart
@@ -36,7 +86,7 @@ def get_recommendations(
     - Includes confidence, lift, support metrics
     - Number of rules that generated each recommendation
     """
-    recommendations = crud.get_recommendations(
+    recommendations = await score_recommendations(
         db=db,
         items=request.items,
         top_n=request.top_n,
@@ -56,32 +106,58 @@ def get_recommendations(
     )
 
 @router.post("/batch")
-def get_batch_recommendations(
+async def get_batch_recommendations(
     requests: list[RecommendationRequest],
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_session)
 ):
     """
     Get recommendations for multiple carts (batch processing)
+    
+    Cached carts are answered from the recommendation cache; the rest are
+    scored together, in memory when the rule index is loaded, otherwise
+    with a single set-based query
     """
-    if len(requests) > 100:
+    if len(requests) > settings.max_batch_size:
         raise HTTPException(
             status_code=400,
-            detail="Maximum 100 requests per batch"
+            detail=f"Maximum {settings.max_batch_size} requests per batch"
         )
     
-    results = []
-    for req in requests:
-        recommendations = crud.get_recommendations(
+    batch = [None] * len(requests)
+    keys = [None] * len(requests)
+    version = recommendation_cache.version
+    if recommendation_cache.enabled:
+        for i, req in enumerate(requests):
+            keys[i] = recommendation_key(req.items, req.top_n, req.min_confidence, req.min_lift)
+            batch[i] = recommendation_cache.get(keys[i])
+    pending = [i for i, cached in enumerate(batch) if cached is None]
+    
+    index = rule_index.index if settings.use_rule_index else None
+    if not pending:
+        scored = []
+    elif index is not None:
+        carts = [requests[i] for i in pending]
+        scored = []
+        for start in range(0, len(carts), SCORE_CHUNK_SIZE):
+            scored.extend(await run_in_threadpool(_score_carts, index, carts[start:start + SCORE_CHUNK_SIZE]))
+    else:
+        scored = await crud.run(
+            crud.get_batch_recommendations,
             db=db,
-            items=req.items,
-            top_n=req.top_n,
-            min_confidence=req.min_confidence,
-            min_lift=req.min_lift
+            carts=[requests[i].model_dump() for i in pending]
         )
-        
-        results.append({
+    
+    for i, recommendations in zip(pending, scored):
+        batch[i] = recommendations
+        if recommendation_cache.enabled:
+            recommendation_cache.put(keys[i], recommendations, version)
+    
+    results = [
+        {
             "request_items": req.items,
             "recommendations": recommendations
-        })
+        }
+        for req, recommendations in zip(requests, batch)
+    ]
     
-    return {"total_requests": len(results), "results": results}
\ No newline at end of file
+    return {"total_requests": len(results), "results": results}
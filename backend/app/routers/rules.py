@@ -1,23 +1,77 @@
 """
 Rules API endpoints
 """
-from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi import APIRouter, Depends, Query, HTTPException, Header
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
-from ..database import get_db
+from sqlalchemy.exc import SQLAlchemyError
+from starlette.concurrency import run_in_threadpool
+from typing import List, Optional, Tuple, Iterator, AsyncIterator
+from datetime import datetime
+import base64
+import binascii
+import csv
+import io
+import json
+import logging
+from ..database import get_session, engine, async_engine
 from ..models import Rule, RulesResponse, StatsResponse
-from .. import crud
+from ..cache import rule_count_cache
+from ..profiling import ProfiledRoute
+from .. import crud, columnar
 
-router = APIRouter(prefix="/rules", tags=["Rules"])
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/rules", tags=["Rules"], route_class=ProfiledRoute)
+
+def encode_cursor(rule: dict) -> str:
+    """
+    Opaque cursor for the row after `rule` in (lift, confidence, id) order
+    """
+    key = json.dumps([rule["lift"], rule["confidence"], rule["id"]])
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[float, float, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        lift, confidence, rule_id = json.loads(raw)
+        return float(lift), float(confidence), int(rule_id)
+    except (binascii.Error, ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _columnar_format(format: Optional[str], accept: Optional[str]) -> Optional[str]:
+    fmt = columnar.requested_format(format, accept)
+    if fmt and not columnar.is_available():
+        raise HTTPException(status_code=406, detail="Arrow/Parquet responses need pyarrow installed")
+    return fmt
+
+async def _rules_total(db, min_confidence: float, min_lift: float, min_support: float) -> int:
+    # Totals only change with the rule set: cache per filter tuple
+    count_key = (min_confidence, min_lift, min_support)
+    version = rule_count_cache.version
+    total = rule_count_cache.get(count_key)
+    if total is None:
+        total = await crud.run(
+            crud.get_rules_count,
+            db=db,
+            min_confidence=min_confidence,
+            min_lift=min_lift,
+            min_support=min_support
+        )
+        rule_count_cache.put(count_key, total, version)
+    return total
 
 @router.get("/", response_model=RulesResponse)
-def get_rules(
+async def get_rules(
     min_confidence: float = Query(0.0, ge=0, le=1, description="Minimum confidence"),
     min_lift: float = Query(0.0, ge=0, description="Minimum lift"),
     min_support: float = Query(0.0, ge=0, le=1, description="Minimum support"),
     limit: int = Query(100, ge=1, le=1000, description="Maximum results"),
-    offset: int = Query(0, ge=0, description="Pagination offset"),
-    db: Session = Depends(get_db)
+    offset: int = Query(0, ge=0, description="Pagination offset (prefer cursor)"),
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+    format: Optional[str] = Query(None, pattern="^(json|arrow|parquet)$", description="json, arrow or parquet"),
+    accept: Optional[str] = Header(None),
+    db: Session = Depends(get_session)
 ):
     """
     Get association rules with filters
@@ -27,31 +81,34 @@ def get_rules(
     - **min_support**: Filter by minimum support (0-1)
     - **limit**: Maximum number of results
     - **offset**: Pagination offset
+    - **cursor**: Keyset cursor; every page costs the same as the first
+    - **format**: `arrow` / `parquet` (or `Accept: application/vnd.apache.arrow.stream`)
+      return the page as columns; total and next cursor go in the
+      X-Total-Count and X-Next-Cursor headers
     """
-    rules = crud.get_rules(
-        db=db,
-        min_confidence=min_confidence,
-        min_lift=min_lift,
-        min_support=min_support,
-        limit=limit,
-        offset=offset
-    )
+    fmt = _columnar_format(format, accept)
+    filters = {"min_confidence": min_confidence, "min_lift": min_lift, "min_support": min_support}
+    after = decode_cursor(cursor) if cursor else None
     
-    total = crud.get_rules_count(
-        db=db,
-        min_confidence=min_confidence,
-        min_lift=min_lift,
-        min_support=min_support
-    )
+    if fmt:
+        rows = await crud.run(crud.get_rule_rows, db=db, limit=limit, offset=offset, after=after, **filters)
+        headers = {"X-Total-Count": str(await _rules_total(db, **filters))}
+        if len(rows) == limit:
+            headers["X-Next-Cursor"] = encode_cursor(dict(zip(crud.EXPORT_COLUMNS, rows[-1])))
+        return Response(columnar.encode(rows, fmt), media_type=columnar.MEDIA_TYPES[fmt], headers=headers)
     
-    return RulesResponse(total=total, rules=rules)
+    rules = await crud.run(crud.get_rules, db=db, limit=limit, offset=offset, after=after, **filters)
+    total = await _rules_total(db, **filters)
+    
+    next_cursor = encode_cursor(rules[-1]) if len(rules) == limit else None
+    return RulesResponse(total=total, rules=rules, next_cursor=next_cursor)
 
 @router.get("/stats", response_model=StatsResponse)
-def get_statistics(db: Session = Depends(get_db)):
+async def get_statistics(db: Session = Depends(get_session)):
     """
     Get statistics about association rules
     """
-    stats = crud.get_statistics(db)
+    stats = await crud.run(crud.get_statistics, db)
     
     if not stats:
         raise HTTPException(status_code=404, detail="No rules found in database")
@@ -59,24 +116,133 @@ def get_statistics(db: Session = Depends(get_db)):
     return StatsResponse(**stats)
 
 @router.get("/top-items")
-def get_top_items(
+async def get_top_items(
     limit: int = Query(20, ge=1, le=100, description="Number of items"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_session)
 ):
     """
-    Get top items by frequency in rules
+    Get top items by the number of rules they appear in
     """
-    items = crud.get_top_items(db=db, limit=limit)
+    items = await crud.run(crud.get_top_items, db=db, limit=limit)
     return {"total": len(items), "items": items}
 
 @router.get("/search")
-def search_rules(
+async def search_rules(
     item: str = Query(..., min_length=1, description="Item name to search"),
     limit: int = Query(50, ge=1, le=500),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_session)
 ):
     """
     Search rules containing specific item
     """
-    rules = crud.search_rules_by_item(db=db, item_name=item, limit=limit)
-    return {"total": len(rules), "rules": rules}
\ No newline at end of file
+    rules = await crud.run(crud.search_rules_by_item, db=db, item_name=item, limit=limit)
+    return {"total": len(rules), "rules": rules}
+
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv", **columnar.MEDIA_TYPES}
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+def _encode_batch(rows: List[Tuple], fmt: str) -> bytes:
+    """
+    Encode one cursor batch; no per-row Pydantic models
+    """
+    if fmt == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode()
+    
+    return "".join(
+        json.dumps(dict(zip(crud.EXPORT_COLUMNS, row)), default=_json_default) + "\n"
+        for row in rows
+    ).encode()
+
+def _csv_header() -> bytes:
+    return (",".join(crud.EXPORT_COLUMNS) + "\r\n").encode()
+
+def _iter_export(batches: Iterator[List[Tuple]], fmt: str) -> Iterator[bytes]:
+    if fmt == "csv":
+        yield _csv_header()
+    for rows in batches:
+        yield _encode_batch(rows, fmt)
+
+async def _aiter_export(batches: AsyncIterator[List[Tuple]], fmt: str) -> AsyncIterator[bytes]:
+    if fmt == "csv":
+        yield _csv_header()
+    async for rows in batches:
+        yield _encode_batch(rows, fmt)
+
+def _resume(first: Optional[List[Tuple]], batches: Iterator[List[Tuple]]) -> Iterator[List[Tuple]]:
+    """
+    Replay the prefetched batch, then the rest of the cursor. A database
+    error after the response has started is logged and re-raised, which
+    aborts the connection: the client sees a truncated transfer, never a
+    clean end of body.
+    """
+    if first is None:
+        return
+    yield first
+    try:
+        yield from batches
+    except Exception as e:
+        logger.error(f"✗ Rule export aborted mid-stream: {e}")
+        raise
+
+async def _aresume(first: Optional[List[Tuple]], batches: AsyncIterator[List[Tuple]]) -> AsyncIterator[List[Tuple]]:
+    if first is None:
+        return
+    yield first
+    try:
+        async for rows in batches:
+            yield rows
+    except Exception as e:
+        logger.error(f"✗ Rule export aborted mid-stream: {e}")
+        raise
+
+async def _first_batch(batches) -> Optional[List[Tuple]]:
+    """
+    Fetch the first batch before the response starts, so an unavailable
+    database is a 503 rather than a 200 with an empty body
+    """
+    try:
+        if isinstance(batches, AsyncIterator):
+            return await anext(batches, None)
+        return await run_in_threadpool(next, batches, None)
+    except (SQLAlchemyError, OSError) as e:
+        logger.error(f"✗ Rule export failed to start: {e}")
+        raise HTTPException(status_code=503, detail="Database unavailable")
+
+@router.get("/export")
+async def export_rules(
+    format: Optional[str] = Query(None, pattern="^(ndjson|csv|arrow|parquet)$", description="ndjson (default), csv, arrow or parquet"),
+    min_confidence: float = Query(0.0, ge=0, le=1, description="Minimum confidence"),
+    min_lift: float = Query(0.0, ge=0, description="Minimum lift"),
+    min_support: float = Query(0.0, ge=0, le=1, description="Minimum support"),
+    accept: Optional[str] = Header(None)
+):
+    """
+    Stream every matching rule as NDJSON, CSV, an Arrow IPC stream or Parquet
+    
+    Rows come from a server-side cursor in batches, so memory stays
+    constant whatever the size of the rule set. Each batch becomes one
+    Arrow record batch / Parquet row group. Returns 503 if the first batch
+    cannot be read; a failure later in the stream aborts the connection.
+    """
+    format = _columnar_format(format, accept) or format or "ndjson"
+    filters = {"min_confidence": min_confidence, "min_lift": min_lift, "min_support": min_support}
+    if async_engine is not None:
+        batches = crud.stream_rules_async(async_engine, **filters)
+        batches = _aresume(await _first_batch(batches), batches)
+        body = columnar.aiter_encoded(batches, format) if format in columnar.MEDIA_TYPES else _aiter_export(batches, format)
+    else:
+        batches = crud.stream_rules(engine, **filters)
+        batches = _resume(await _first_batch(batches), batches)
+        body = columnar.iter_encoded(batches, format) if format in columnar.MEDIA_TYPES else _iter_export(batches, format)
+    
+    return StreamingResponse(
+        body,
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f"attachment; filename={crud.RULES_TABLE}.{format}"}
+    )
@@ -0,0 +1,207 @@
+"""
+In-memory rule index for recommendations
+"""
+from sqlalchemy import text
+from typing import List, Dict, Any, Optional, Callable
+from datetime import datetime
+from itertools import chain
+import numpy as np
+import threading
+import logging
+
+from .config import settings
+from .database import engine
+from .metrics import query_function
+
+logger = logging.getLogger(__name__)
+
+def _postings(rule_items: List[List[int]], n_items: int):
+    """
+    Inverted lists item id -> rule rows, as CSR (offsets, rules)
+    """
+    lengths = np.fromiter((len(ids) for ids in rule_items), dtype=np.int64, count=len(rule_items))
+    flat = np.fromiter(chain.from_iterable(rule_items), dtype=np.int64, count=int(lengths.sum()))
+    rows = np.repeat(np.arange(len(rule_items), dtype=np.int64), lengths)
+    order = np.argsort(flat, kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(flat, minlength=n_items))]).astype(np.int64)
+    return offsets, rows[order], lengths
+
+class RuleIndex:
+    """
+    Immutable snapshot of the rules table (RULES_TABLE)
+
+    Antecedent and consequent items are kept as inverted lists (item id ->
+    rule rows). A rule matches a cart when every antecedent item is in the
+    cart, i.e. the cart's postings hit it antecedent-length times. Items are
+    integer ids; strings only appear in the final response.
+    """
+
+    def __init__(self, rows: List[Any], items: List[Any], version: Optional[datetime]):
+        self.version = version
+        self.total_rules = len(rows)
+        self.item_ids: Dict[str, int] = {row.item_key: row.item_id for row in items}
+        n_items = max(self.item_ids.values(), default=-1) + 1
+
+        self.antecedent_offsets, self.antecedent_rules, self.antecedent_len = _postings(
+            [row.antecedent_ids for row in rows], n_items
+        )
+        self.consequent_offsets, self.consequent_rules, _ = _postings(
+            [row.consequent_ids for row in rows], n_items
+        )
+
+        # Recommendations are grouped by consequent label, like the SQL path
+        consequent_ids: Dict[str, int] = {}
+        self.consequent_names: List[str] = []
+        self.consequent = np.empty(len(rows), dtype=np.int32)
+        for i, row in enumerate(rows):
+            if row.consequent not in consequent_ids:
+                consequent_ids[row.consequent] = len(consequent_ids)
+                self.consequent_names.append(row.consequent)
+            self.consequent[i] = consequent_ids[row.consequent]
+
+        self.confidence = np.array([row.confidence for row in rows], dtype=np.float64)
+        self.lift = np.array([row.lift for row in rows], dtype=np.float64)
+        self.support = np.array([row.support for row in rows], dtype=np.float64)
+
+    def _lookup(self, offsets: np.ndarray, rules: np.ndarray, cart: List[int]) -> np.ndarray:
+        return np.concatenate(
+            [rules[offsets[i]:offsets[i + 1]] for i in cart] or [np.empty(0, dtype=np.int64)]
+        )
+
+    def recommend(
+        self,
+        items: List[str],
+        top_n: int = 5,
+        min_confidence: float = 0.1,
+        min_lift: float = 1.0
+    ) -> List[Dict[str, Any]]:
+        """
+        Same result as crud.get_recommendations, computed in memory
+        """
+        cart = sorted({self.item_ids[item.lower()] for item in items if item.lower() in self.item_ids})
+        if not cart:
+            return []
+
+        # Antecedent subset of the cart: hit once per antecedent item
+        candidates, hits = np.unique(
+            self._lookup(self.antecedent_offsets, self.antecedent_rules, cart),
+            return_counts=True
+        )
+        rows = candidates[hits == self.antecedent_len[candidates]]
+        rows = rows[
+            (self.confidence[rows] >= min_confidence)
+            & (self.lift[rows] >= min_lift)
+            & ~np.isin(rows, self._lookup(self.consequent_offsets, self.consequent_rules, cart))
+        ]
+        if len(rows) == 0:
+            return []
+
+        # GROUP BY consequent: averages via bincount
+        consequents, group = np.unique(self.consequent[rows], return_inverse=True)
+        matched_rules = np.bincount(group)
+        lift = np.bincount(group, self.lift[rows]) / matched_rules
+        confidence = np.bincount(group, self.confidence[rows]) / matched_rules
+        support = np.bincount(group, self.support[rows]) / matched_rules
+
+        # ORDER BY score DESC, confidence DESC LIMIT top_n
+        top = np.lexsort((-confidence, -lift))[:top_n]
+        return [
+            {
+                "item_name": self.consequent_names[consequents[i]],
+                "score": float(lift[i]),
+                "confidence": float(confidence[i]),
+                "lift": float(lift[i]),
+                "support": float(support[i]),
+                "matched_rules": int(matched_rules[i])
+            }
+            for i in top
+        ]
+
+class RuleIndexManager:
+    """
+    Tracks the rule set version (MAX(created_at) of RULES_TABLE) in the
+    background; holds the current RuleIndex when build_index is set and
+    notifies listeners whenever a new rule set appears
+    """
+
+    def __init__(self, refresh_interval: float, build_index: bool = True):
+        self.refresh_interval = refresh_interval
+        self.build_index = build_index
+        self.version: Optional[datetime] = None
+        self.loaded_at: Optional[datetime] = None
+        self._index: Optional[RuleIndex] = None
+        self._listeners: List[Callable[[Optional[datetime]], None]] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def index(self) -> Optional[RuleIndex]:
+        return self._index
+
+    def is_loaded(self) -> bool:
+        return self._index is not None
+
+    def add_listener(self, callback: Callable[[Optional[datetime]], None]):
+        """
+        Call `callback(version)` after each rule set change
+        """
+        self._listeners.append(callback)
+
+    def _latest_version(self) -> Optional[datetime]:
+        with query_function("rule_index_version"), engine.connect() as conn:
+            return conn.execute(text(f"SELECT MAX(created_at) FROM {settings.rules_table}")).scalar()
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Pick up a new rule set if it changed; returns True if it did
+        """
+        try:
+            version = self._latest_version()
+            if not force and version == self.version and (self._index is not None or not self.build_index):
+                return False
+
+            if self.build_index:
+                with query_function("rule_index_reload"), engine.connect() as conn:
+                    rows = conn.execute(text(f"""
+                        SELECT consequent, support, confidence, lift, antecedent_ids, consequent_ids
+                        FROM {settings.rules_table}
+                    """)).all()
+                    items = conn.execute(text(
+                        f"SELECT item_id, item_key FROM {settings.rules_table}_items"
+                    )).all()
+
+                # Reference swap is atomic: in-flight requests keep the old index
+                self._index = RuleIndex(rows, items, version)
+                logger.info(f"✓ Rule index loaded: {len(rows)} rules (version {version})")
+        except Exception as e:
+            logger.error(f"✗ Rule index reload failed: {e}")
+            return False
+
+        self.version = version
+        self.loaded_at = datetime.now()
+        for callback in self._listeners:
+            callback(version)
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.refresh_interval):
+            self.reload()
+
+    def start(self):
+        """
+        Load the rule set and start the background refresh thread
+        """
+        self.reload(force=True)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="rule-index-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+rule_index = RuleIndexManager(
+    settings.rule_index_refresh_interval,
+    build_index=settings.use_rule_index
+)
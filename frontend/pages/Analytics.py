@@ -37,7 +37,7 @@ if 'analytics_data' not in st.session_state:
         st.session_state.analytics_data = {
             'stats': api.get_statistics(),
             'top_items': api.get_top_items(limit=30),
-            'rules': api.get_rules(limit=1000)
+            'rules': api.get_rules_frame(limit=1000)
         }
 
 data = st.session_state.analytics_data
@@ -122,10 +122,10 @@ st.divider()
 # ============= SECTION 3: Rules Distribution =============
 st.subheader("📊 Rules Distribution Analysis")
 
-rules_data = data['rules'].get('rules', [])
+df_rules = data['rules'].get('rules', pd.DataFrame())
+rules_data = not df_rules.empty
 
 if rules_data:
-    df_rules = pd.DataFrame(rules_data)
     
     # Three columns for distributions
     col1, col2, col3 = st.columns(3)
@@ -50,7 +50,7 @@ with st.sidebar:
 # Main Content
 if load_btn or 'rules_data' not in st.session_state:
     with st.spinner("Loading rules..."):
-        result = api.get_rules(
+        result = api.get_rules_frame(
             min_confidence=min_confidence,
             min_lift=min_lift,
             min_support=min_support,
@@ -62,14 +62,14 @@ if load_btn or 'rules_data' not in st.session_state:
 # Display Rules
 if 'rules_data' in st.session_state:
     result = st.session_state.rules_data
-    rules = result.get('rules', [])
+    rules = result.get('rules', pd.DataFrame())
     total = result.get('total', 0)
     
-    if rules:
+    if not rules.empty:
         st.success(f"✅ Loaded {len(rules)} rules (Total matching: {total})")
         
-        # Convert to DataFrame
-        df = pd.DataFrame(rules)
+        # Copy: the formatting below must not touch the cached frame
+        df = rules.copy()
         
         # Format columns
         df['support'] = df['support'].apply(lambda x: f"{x:.4f}")
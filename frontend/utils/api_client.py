@@ -3,9 +3,19 @@ API Client for FastAPI backend
 """
 import requests
 import streamlit as st
+import pandas as pd
 from typing import List, Dict, Any, Optional
 import logging
 
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # fall back to JSON rules
+    pa = None
+    pq = None
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
 logger = logging.getLogger(__name__)
 
 class APIClient:
@@ -65,9 +75,10 @@ class APIClient:
         min_lift: float = 0.0,
         min_support: float = 0.0,
         limit: int = 100,
-        offset: int = 0
+        offset: int = 0,
+        cursor: Optional[str] = None
     ) -> Dict[str, Any]:
-        """Get association rules"""
+        """Get association rules (pass the previous page's next_cursor as cursor)"""
         params = {
             "min_confidence": min_confidence,
             "min_lift": min_lift,
@@ -75,6 +86,8 @@ class APIClient:
             "limit": limit,
             "offset": offset
         }
+        if cursor:
+            params["cursor"] = cursor
         
         try:
             response = requests.get(
@@ -86,6 +99,85 @@ class APIClient:
         except:
             return {"total": 0, "rules": []}
     
+    def _read_frame(self, response: requests.Response, format: str) -> pd.DataFrame:
+        """Arrow stream / Parquet body -> DataFrame, reading the bytes in place"""
+        buffer = pa.py_buffer(response.content)
+        if format == "parquet":
+            table = pq.read_table(buffer)
+        else:
+            table = pa.ipc.open_stream(buffer).read_all()
+        return table.to_pandas(split_blocks=True, self_destruct=True)
+    
+    def get_rules_frame(
+        self,
+        min_confidence: float = 0.0,
+        min_lift: float = 0.0,
+        min_support: float = 0.0,
+        limit: int = 100,
+        offset: int = 0,
+        cursor: Optional[str] = None,
+        format: str = "arrow"
+    ) -> Dict[str, Any]:
+        """Get association rules as a DataFrame (format: arrow or parquet)"""
+        if pa is None:
+            result = self.get_rules(min_confidence, min_lift, min_support, limit, offset, cursor)
+            return {**result, "rules": pd.DataFrame(result.get("rules", []))}
+        
+        params = {
+            "min_confidence": min_confidence,
+            "min_lift": min_lift,
+            "min_support": min_support,
+            "limit": limit,
+            "offset": offset,
+            "format": format
+        }
+        if cursor:
+            params["cursor"] = cursor
+        
+        try:
+            response = requests.get(
+                f"{self.base_url}/rules/",
+                params=params,
+                headers={"Accept": ARROW_STREAM_MEDIA_TYPE},
+                timeout=10
+            )
+            response.raise_for_status()
+            return {
+                "total": int(response.headers.get("X-Total-Count", 0)),
+                "rules": self._read_frame(response, format),
+                "next_cursor": response.headers.get("X-Next-Cursor")
+            }
+        except Exception as e:
+            logger.error(f"Rules frame error: {e}")
+            return {"total": 0, "rules": pd.DataFrame()}
+    
+    def export_rules_frame(
+        self,
+        min_confidence: float = 0.0,
+        min_lift: float = 0.0,
+        min_support: float = 0.0,
+        format: str = "arrow"
+    ) -> pd.DataFrame:
+        """Every matching rule as a DataFrame, via the streaming export"""
+        params = {
+            "min_confidence": min_confidence,
+            "min_lift": min_lift,
+            "min_support": min_support,
+            "format": format
+        }
+        
+        try:
+            response = requests.get(
+                f"{self.base_url}/rules/export",
+                params=params,
+                timeout=120
+            )
+            response.raise_for_status()
+            return self._read_frame(response, format)
+        except Exception as e:
+            logger.error(f"Rules export error: {e}")
+            return pd.DataFrame()
+    
     def get_statistics(self) -> Dict[str, Any]:
         """Get rules statistics"""
         try:
@@ -4,20 +4,49 @@ Generates association rules and saves to PostgreSQL
 
 Usage:
     python scripts/fp_growth.py --min-support 0.01 --min-confidence 0.1 --min-lift 1.0
+    python scripts/fp_growth.py --engine eclat --min-support 0.01
+    python scripts/fp_growth.py --incremental --min-support 0.01
+    python scripts/fp_growth.py --top-k 500 --by lift --min-confidence 0.3
 """
 
 import argparse
+import functools
+import heapq
+import io
+import json
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
-from mlxtend.frequent_patterns import fpgrowth, association_rules
-from mlxtend.preprocessing import TransactionEncoder
+from scipy import sparse as sp
+from sqlalchemy import bindparam, create_engine, inspect, text
+from mlxtend.frequent_patterns import fpgrowth
 import os
+import resource
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from array import array
+from collections import namedtuple
+from itertools import combinations, count
 from dotenv import load_dotenv
 from datetime import datetime
 
 # Load environment variables
 load_dotenv()
 
+# Tự chuyển sang ma trận sparse khi mật độ thấp hơn ngưỡng này
+# hoặc ma trận dense (1 byte/ô) vượt quá DENSE_MAX_BYTES
+SPARSE_DENSITY_THRESHOLD = 0.01
+DENSE_MAX_BYTES = 1 << 30
+
+# Ước lượng bộ nhớ cho mỗi frequent itemset (frame + rules sinh ra từ nó)
+ITEMSET_BYTES = 1024
+# Số giao dịch lấy mẫu khi ước lượng số itemset cho một ngưỡng
+PROFILE_SAMPLE_SIZE = 20_000
+
+Budget = namedtuple('Budget', ['max_itemsets', 'max_memory_mb'])
+
+class BudgetExceeded(Exception):
+    """Số itemset hoặc bộ nhớ vượt ngân sách trong lúc mine"""
+
 def get_database_connection():
     """Tạo kết nối PostgreSQL"""
     db_url = os.getenv(
@@ -26,87 +55,1270 @@ def get_database_connection():
     )
     return create_engine(db_url)
 
-def load_transactions(engine):
-    """Load transaction data từ PostgreSQL"""
-    print("Loading transactions from database...")
-    query = "SELECT txn_id, item_name FROM stg_transaction_items ORDER BY txn_id"
-    df = pd.read_sql(query, engine)
+class Baskets(namedtuple('Baskets', ['items', 'indptr', 'indices', 'txn_ids'],
+                         defaults=(None,))):
+    """
+    Transactions ở dạng CSR với item mã hoá số nguyên
+    
+    Giao dịch thứ i gồm items[indices[indptr[i]:indptr[i + 1]]],
+    txn_ids (nếu có) là txn_id gốc trong database
+    """
+    __slots__ = ()
+    
+    @property
+    def n_transactions(self):
+        return len(self.indptr) - 1
+    
+    def txn_rows(self):
+        """Chỉ số giao dịch tương ứng với từng phần tử của indices"""
+        return np.repeat(
+            np.arange(self.n_transactions, dtype=np.int64),
+            np.diff(self.indptr)
+        )
+
+def encode_baskets(basket):
+    """Chuyển list các giao dịch (list tên item) sang Baskets"""
+    if isinstance(basket, Baskets):
+        return basket
+    
+    item_codes = {}
+    indptr = array('q', [0])
+    indices = array('i')
+    for txn in basket:
+        for item in dict.fromkeys(txn):
+            indices.append(item_codes.setdefault(item, len(item_codes)))
+        indptr.append(len(indices))
     
-    # Group by transaction
-    basket = df.groupby('txn_id')['item_name'].apply(list).tolist()
-    print(f"Loaded {len(basket)} transactions")
-    return basket
+    return Baskets(
+        items=list(item_codes),
+        indptr=np.frombuffer(indptr, dtype=np.int64),
+        indices=np.frombuffer(indices, dtype=np.int32)
+    )
+
+def _peak_rss_mb():
+    """Peak RSS của process (MB), ru_maxrss tính bằng KB trên Linux"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _current_rss_mb():
+    """RSS hiện tại (MB); dùng peak RSS nếu không có /proc"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024**2
+    except (OSError, ValueError):
+        return _peak_rss_mb()
+
+def check_budget(budget, n_itemsets):
+    """Raise BudgetExceeded nếu số itemset hoặc RSS vượt ngân sách"""
+    if budget is None:
+        return
+    if budget.max_itemsets is not None and n_itemsets > budget.max_itemsets:
+        raise BudgetExceeded(f"{n_itemsets} itemsets > max_itemsets={budget.max_itemsets}")
+    if budget.max_memory_mb is not None:
+        rss = _current_rss_mb()
+        if rss > budget.max_memory_mb:
+            raise BudgetExceeded(f"RSS {rss:.0f} MB > max_memory={budget.max_memory_mb} MB")
 
-def apply_fp_growth(basket, min_support=0.01):
-    """Áp dụng FP-Growth algorithm"""
-    print(f"\nRunning FP-Growth with min_support={min_support}...")
+def load_transactions(engine, chunk_size=100_000, after_txn_id=None, up_to_txn_id=None,
+                      items=None, verbose=True):
+    """
+    Load transaction data từ PostgreSQL
+    
+    Đọc qua server-side cursor theo thứ tự txn_id, mỗi lần chunk_size dòng,
+    và dựng trực tiếp Baskets (item -> mã số nguyên) nên bộ nhớ chỉ gồm
+    hai mảng int và một chunk dòng đang xử lý.
+    
+    after_txn_id / up_to_txn_id giới hạn khoảng txn_id (after < id <= up_to),
+    items chỉ lấy các dòng thuộc danh sách item này.
+    """
+    if verbose:
+        print(f"Loading transactions from database (chunk_size={chunk_size})...")
+    
+    conditions, params = [], {}
+    if after_txn_id is not None:
+        conditions.append("txn_id > :after_txn_id")
+        params['after_txn_id'] = after_txn_id
+    if up_to_txn_id is not None:
+        conditions.append("txn_id <= :up_to_txn_id")
+        params['up_to_txn_id'] = up_to_txn_id
+    if items is not None:
+        conditions.append("item_name IN :items")
+        params['items'] = list(items)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    
+    query = text(f"""
+        SELECT DISTINCT txn_id, item_name
+        FROM stg_transaction_items
+        {where}
+        ORDER BY txn_id
+    """)
+    if items is not None:
+        query = query.bindparams(bindparam('items', expanding=True))
+    
+    item_codes = {}
+    indptr = array('q')
+    indices = array('i')
+    basket_txn_ids = array('q')
+    last_txn_id = None
+    n_rows = 0
+    
+    with engine.connect() as conn:
+        result = conn.execution_options(
+            stream_results=True,
+            max_row_buffer=chunk_size
+        ).execute(query, params)
+        
+        for rows in result.partitions(chunk_size):
+            txn_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+            codes = np.fromiter(
+                (item_codes.setdefault(row[1], len(item_codes)) for row in rows),
+                dtype=np.int32,
+                count=len(rows)
+            )
+            
+            # Vị trí bắt đầu giao dịch mới (txn_id khác dòng trước đó)
+            prev_ids = np.empty_like(txn_ids)
+            prev_ids[1:] = txn_ids[:-1]
+            prev_ids[0] = txn_ids[0] - 1 if last_txn_id is None else last_txn_id
+            starts = np.flatnonzero(txn_ids != prev_ids)
+            
+            indptr.extend((starts + n_rows).tolist())
+            basket_txn_ids.extend(txn_ids[starts].tolist())
+            indices.frombytes(codes.tobytes())
+            n_rows += len(rows)
+            last_txn_id = txn_ids[-1]
+    
+    indptr.append(n_rows)
+    baskets = Baskets(
+        items=list(item_codes),
+        indptr=np.frombuffer(indptr, dtype=np.int64),
+        indices=np.frombuffer(indices, dtype=np.int32),
+        txn_ids=np.frombuffer(basket_txn_ids, dtype=np.int64)
+    )
+    
+    if verbose:
+        basket_mb = (baskets.indptr.nbytes + baskets.indices.nbytes) / 1024**2
+        print(f"Loaded {baskets.n_transactions} transactions, "
+              f"{len(baskets.items)} items, {n_rows} rows")
+        print(f"Basket arrays: {basket_mb:.1f} MB, peak RSS: {_peak_rss_mb():.1f} MB")
+    return baskets
+
+def frequent_item_ids(baskets, min_support):
+    """Mã các item có support >= min_support (item lẻ không thể nằm trong itemset phổ biến)"""
+    counts = np.bincount(baskets.indices, minlength=len(baskets.items))
+    return np.flatnonzero(counts / max(baskets.n_transactions, 1) >= min_support)
+
+def encode_frame(baskets, min_support, sparse=None, verbose=True):
+    """
+    One-hot DataFrame cho mlxtend, chỉ gồm các item phổ biến
+    
+    sparse=None: tự chọn dựa trên mật độ ước lượng, nên catalog lớn
+    không bao giờ dựng ma trận dense n_transactions x n_items
+    """
+    n_transactions = baskets.n_transactions
+    item_ids = frequent_item_ids(baskets, min_support)
+    columns = [baskets.items[j] for j in item_ids]
+    
+    # Mã lại item phổ biến thành 0..k-1, bỏ các phần tử còn lại
+    new_codes = np.full(len(baskets.items), -1, dtype=np.int64)
+    new_codes[item_ids] = np.arange(len(item_ids))
+    mask = new_codes[baskets.indices] >= 0
+    rows = baskets.txn_rows()[mask]
+    cols = new_codes[baskets.indices[mask]]
+    
+    n_cells = n_transactions * len(columns)
+    density = len(cols) / n_cells if n_cells else 0.0
+    if sparse is None:
+        sparse = density < SPARSE_DENSITY_THRESHOLD or n_cells > DENSE_MAX_BYTES
+    if verbose:
+        print(f"Encoding {n_transactions} x {len(columns)} frequent items "
+              f"(density={density:.4f}, {'sparse' if sparse else 'dense'})")
+    
+    if sparse:
+        matrix = sp.csr_matrix(
+            (np.ones(len(cols), dtype=np.uint8), (rows, cols)),
+            shape=(n_transactions, len(columns))
+        )
+        # from_spmatrix trên ma trận bool sinh SparseDtype(bool, 0) (FutureWarning):
+        # dựng từ uint8 rồi ép về SparseDtype(bool, False)
+        return pd.DataFrame.sparse.from_spmatrix(matrix, columns=columns).astype(
+            pd.SparseDtype(bool, False)
+        )
+    
+    encoded = np.zeros((n_transactions, len(columns)), dtype=bool)
+    encoded[rows, cols] = True
+    return pd.DataFrame(encoded, columns=columns)
+
+# Popcount lookup cho numpy < 2.0 (không có np.bitwise_count)
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def _popcount(words):
+    """Đếm số bit 1 trên mỗi hàng của ma trận bitset uint64"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+    return _POPCOUNT_TABLE[words.view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+def build_item_bitsets(baskets, item_ids):
+    """
+    Vertical encoding: mỗi item -> bitset các txn chứa nó
+    
+    Returns ma trận uint64 kích thước len(item_ids) x ceil(n_transactions / 64),
+    hàng k ứng với baskets.items[item_ids[k]]
+    """
+    new_codes = np.full(len(baskets.items), -1, dtype=np.int64)
+    new_codes[item_ids] = np.arange(len(item_ids))
+    rows = new_codes[baskets.indices]
+    mask = rows >= 0
+    rows = rows[mask]
+    cols = baskets.txn_rows()[mask]
+    
+    n_words = (baskets.n_transactions + 63) // 64
+    bitsets = np.zeros((len(item_ids), n_words), dtype=np.uint64)
+    np.bitwise_or.at(
+        bitsets,
+        (rows, cols >> 6),
+        np.left_shift(np.uint64(1), (cols & 63).astype(np.uint64))
+    )
+    return bitsets
+
+def eclat(basket, min_support=0.01, max_len=None, max_itemsets=None):
+    """
+    Eclat trên bitset: support = popcount(AND các bitset)
+    
+    Trả về DataFrame cùng định dạng với mlxtend fpgrowth
+    (cột 'support', 'itemsets' là frozenset tên item).
+    max_itemsets: raise BudgetExceeded ngay khi tìm thấy nhiều hơn
+    """
+    baskets = encode_baskets(basket)
+    n_transactions = baskets.n_transactions
+    # Chỉ dựng bitset cho item phổ biến, tránh ma trận n_items x n_transactions
+    item_ids = frequent_item_ids(baskets, min_support)
+    items = [baskets.items[j] for j in item_ids]
+    if n_transactions == 0 or not items:
+        return pd.DataFrame({'support': pd.Series(dtype=float), 'itemsets': []})
+    bitsets = build_item_bitsets(baskets, item_ids)
+    
+    counts = _popcount(bitsets)
+    frequent = np.flatnonzero(counts / n_transactions >= min_support)
+    # Duyệt theo support tăng dần để tidset giao nhau nhỏ nhanh hơn
+    frequent = frequent[np.argsort(counts[frequent], kind='stable')]
+    
+    found_counts, found_itemsets = [], []
+    
+    def extend(prefix, cand_ids, cand_bits, cand_counts):
+        for i in range(len(cand_ids)):
+            itemset = prefix + (cand_ids[i],)
+            found_counts.append(cand_counts[i])
+            found_itemsets.append(itemset)
+            if max_itemsets is not None and len(found_itemsets) > max_itemsets:
+                raise BudgetExceeded(f"more than {max_itemsets} itemsets")
+            
+            if (max_len is not None and len(itemset) >= max_len) or i + 1 == len(cand_ids):
+                continue
+            
+            # AND bitset hiện tại với tất cả ứng viên phía sau cùng lúc
+            next_bits = cand_bits[i + 1:] & cand_bits[i]
+            next_counts = _popcount(next_bits)
+            keep = next_counts / n_transactions >= min_support
+            if keep.any():
+                extend(
+                    itemset,
+                    cand_ids[i + 1:][keep],
+                    next_bits[keep],
+                    next_counts[keep]
+                )
+    
+    extend((), frequent, bitsets[frequent], counts[frequent])
+    
+    return pd.DataFrame({
+        'support': np.asarray(found_counts, dtype=np.int64) / n_transactions,
+        'itemsets': [frozenset(items[j] for j in itemset) for itemset in found_itemsets]
+    })
+
+def mine_itemsets(baskets, min_support, engine='fpgrowth', sparse=None, max_len=None,
+                  verbose=True, max_itemsets=None):
+    """Tìm frequent itemsets trên một process (fpgrowth hoặc eclat)"""
+    if engine == 'eclat':
+        return eclat(baskets, min_support=min_support, max_len=max_len,
+                     max_itemsets=max_itemsets)
     
     # Transaction encoding
-    te = TransactionEncoder()
-    te_ary = te.fit(basket).transform(basket)
-    df_encoded = pd.DataFrame(te_ary, columns=te.columns_)
+    df_encoded = encode_frame(baskets, min_support, sparse, verbose=verbose)
+    if df_encoded.shape[1] == 0:
+        return pd.DataFrame({'support': pd.Series(dtype=float), 'itemsets': []})
     
     # FP-Growth
-    frequent_itemsets = fpgrowth(
+    return fpgrowth(
         df_encoded, 
         min_support=min_support, 
         use_colnames=True,
-        max_len=None  # Không giới hạn độ dài itemset
+        max_len=max_len  # None: không giới hạn độ dài itemset
+    )
+
+def _mine_conditional(task):
+    """
+    Worker: mine conditional database của một item
+    
+    Trả về số đếm nguyên (không phải support) để process cha
+    tính support theo tổng số giao dịch giống hệt bản đơn process
+    """
+    rank, indptr, indices, n_cols, min_support, engine, sparse, max_len, max_itemsets = task
+    # Tên cột dạng chuỗi: mlxtend từ chối DataFrame sparse có tên cột số nguyên
+    # không bắt đầu từ 0 (khi item 0 không phổ biến trong conditional db)
+    cond = Baskets(items=[str(j) for j in range(n_cols)], indptr=indptr, indices=indices)
+    frequent = mine_itemsets(cond, min_support, engine, sparse, max_len, verbose=False,
+                             max_itemsets=max_itemsets)
+    counts = np.rint(frequent['support'].to_numpy() * cond.n_transactions).astype(np.int64)
+    return rank, counts, [tuple(int(j) for j in itemset) for itemset in frequent['itemsets']]
+
+def _bounded_map(pool, func, tasks, window):
+    """
+    Như pool.map nhưng chỉ giữ tối đa window task đang chờ / chạy: task sau
+    chỉ được dựng (và pickle) khi có chỗ trống, trả kết quả theo thứ tự xong
+    """
+    tasks = iter(tasks)
+    pending = set()
+    while True:
+        for task in tasks:
+            pending.add(pool.submit(func, task))
+            if len(pending) >= window:
+                break
+        if not pending:
+            return
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+def parallel_mine(baskets, min_support, engine='fpgrowth', workers=2, sparse=None,
+                  max_len=None, budget=None):
+    """
+    Parallel FP-Growth: chia không gian tìm kiếm theo item
+    
+    Item xếp theo support tăng dần; conditional database của item hạng r
+    gồm các giao dịch chứa nó, chỉ giữ item có hạng > r. Mỗi itemset phổ
+    biến thuộc đúng một partition (item hạng thấp nhất của nó), nên hợp
+    các kết quả bằng đúng kết quả mine toàn bộ.
+    
+    workers=1 chạy tuần tự trong process; budget được kiểm tra sau mỗi
+    partition để dừng sớm khi số itemset / bộ nhớ vượt ngân sách. RSS chỉ đo
+    được ở process này (fpgrowth trong worker cũng bỏ qua max_itemsets) nên
+    budget chỉ dùng được với workers=1.
+    """
+    if budget is not None and workers > 1:
+        raise ValueError("budget requires workers=1: worker memory is not counted")
+    n_transactions = baskets.n_transactions
+    item_ids = frequent_item_ids(baskets, min_support)
+    item_counts = np.bincount(baskets.indices, minlength=len(baskets.items))[item_ids]
+    item_ids = item_ids[np.argsort(item_counts, kind='stable')]
+    item_counts = np.sort(item_counts, kind='stable')
+    
+    # Ma trận txn x item (cột theo hạng) để cắt conditional database
+    rank_of = np.full(len(baskets.items), -1, dtype=np.int64)
+    rank_of[item_ids] = np.arange(len(item_ids))
+    cols = rank_of[baskets.indices]
+    mask = cols >= 0
+    matrix = sp.csr_matrix(
+        (np.ones(int(mask.sum()), dtype=bool), (baskets.txn_rows()[mask], cols[mask])),
+        shape=(n_transactions, len(item_ids))
+    )
+    by_item = matrix.tocsc()
+    max_itemsets = None if budget is None else budget.max_itemsets
+    
+    def tasks():
+        n_partitions = len(item_ids) - 1 if max_len is None or max_len > 1 else 0
+        # Partition nhiều giao dịch chạy trước để cân bằng tải giữa các worker
+        for rank in sorted(range(n_partitions), key=lambda r: item_counts[r], reverse=True):
+            rows = by_item.indices[by_item.indptr[rank]:by_item.indptr[rank + 1]]
+            cond = matrix[rows, rank + 1:]
+            cond.sort_indices()
+            # Ngưỡng tương đối trên conditional db, nới nhẹ để bù sai số float;
+            # lọc chính xác count / n_transactions >= min_support ở process cha
+            cond_support = min(1.0, min_support * n_transactions / len(rows) * (1 - 1e-9))
+            yield (
+                rank,
+                cond.indptr.astype(np.int64),
+                cond.indices.astype(np.int32),
+                cond.shape[1],
+                cond_support,
+                engine,
+                sparse,
+                None if max_len is None else max_len - 1,
+                max_itemsets
+            )
+    
+    found_counts = list(item_counts)
+    found_itemsets = [(rank,) for rank in range(len(item_ids))]
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        # Cửa sổ 2*workers: mỗi lúc chỉ vài conditional database tồn tại,
+        # và thứ tự partition lớn trước thực sự được giữ khi phân phối
+        results = (_bounded_map(pool, _mine_conditional, tasks(), 2 * workers) if pool
+                   else map(_mine_conditional, tasks()))
+        for rank, counts, itemsets in results:
+            for count, itemset in zip(counts, itemsets):
+                found_counts.append(count)
+                found_itemsets.append((rank,) + tuple(rank + 1 + j for j in itemset))
+            check_budget(budget, len(found_itemsets))
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+    
+    support = np.asarray(found_counts, dtype=np.int64) / n_transactions
+    keep = support >= min_support
+    return pd.DataFrame({
+        'support': support[keep],
+        'itemsets': [
+            frozenset(baskets.items[item_ids[r]] for r in itemset)
+            for itemset, kept in zip(found_itemsets, keep) if kept
+        ]
+    })
+
+def profile_baskets(baskets):
+    """Thống kê nhanh: support từng item và độ dài giỏ hàng"""
+    item_support = np.bincount(baskets.indices, minlength=len(baskets.items)) \
+        / max(baskets.n_transactions, 1)
+    lengths = np.diff(baskets.indptr)
+    return {
+        'n_transactions': baskets.n_transactions,
+        'n_items': len(baskets.items),
+        'max_item_support': float(item_support.max()) if len(item_support) else 0.0,
+        'avg_basket_len': float(lengths.mean()) if len(lengths) else 0.0,
+        'max_basket_len': int(lengths.max()) if len(lengths) else 0,
+    }
+
+def sample_baskets(baskets, size, seed=0):
+    """Lấy mẫu ngẫu nhiên `size` giao dịch (giữ nguyên nếu ít hơn)"""
+    if baskets.n_transactions <= size:
+        return baskets
+    rows = np.sort(np.random.default_rng(seed).choice(baskets.n_transactions, size, replace=False))
+    lengths = np.diff(baskets.indptr)[rows]
+    starts = baskets.indptr[rows]
+    positions = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths) \
+        + np.arange(lengths.sum())
+    return Baskets(
+        items=baskets.items,
+        indptr=np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+        indices=baskets.indices[positions]
     )
+
+def choose_thresholds(baskets, budget, floor_support=None):
+    """
+    Chọn min_support thấp nhất (và max_len nếu cần) vừa ngân sách
+    
+    Ước lượng số itemset bằng Eclat trên mẫu PROFILE_SAMPLE_SIZE giao dịch,
+    đi dần xuống theo thang ngưỡng; dừng ở ngưỡng đầu tiên vượt ngân sách.
+    Returns (min_support, max_len)
+    """
+    profile = profile_baskets(baskets)
+    print(f"\nProfile: {profile['n_transactions']} transactions, {profile['n_items']} items, "
+          f"basket length avg {profile['avg_basket_len']:.1f} / max {profile['max_basket_len']}, "
+          f"top item support {profile['max_item_support']:.4f}")
+    
+    max_itemsets = budget.max_itemsets
+    if budget.max_memory_mb is not None:
+        by_memory = int((budget.max_memory_mb - _current_rss_mb()) * 1024**2 / ITEMSET_BYTES)
+        max_itemsets = by_memory if max_itemsets is None else min(max_itemsets, by_memory)
+    # Chừa 20% cho sai số lấy mẫu
+    limit = max(int(max_itemsets * 0.8), 1)
+    
+    sample = sample_baskets(baskets, PROFILE_SAMPLE_SIZE)
+    floor_support = floor_support or 1 / max(baskets.n_transactions, 1)
+    # 0.5, 0.2, 0.1, 0.05, ... giới hạn trong [floor_support, support item lớn nhất]
+    ceiling = max(profile['max_item_support'], floor_support)
+    ladder = [float(f'{m}e-{e}') for e in range(1, 8) for m in (5, 2, 1)]
+    ladder = [x for x in ladder if floor_support <= x <= ceiling]
+    
+    chosen = (ladder[0] if ladder else floor_support, None)
+    for min_support in ladder:
+        try:
+            frequent = eclat(sample, min_support, max_itemsets=limit)
+            chosen = (min_support, None)
+            print(f"  min_support={min_support:g}: ~{len(frequent)} itemsets")
+            continue
+        except BudgetExceeded:
+            pass
+        
+        # Vượt ngân sách: thử giới hạn độ dài itemset ở ngưỡng này
+        for max_len in range(profile['max_basket_len'] - 1, 1, -1):
+            try:
+                frequent = eclat(sample, min_support, max_len=max_len, max_itemsets=limit)
+            except BudgetExceeded:
+                continue
+            chosen = (min_support, max_len)
+            print(f"  min_support={min_support:g}, max_len={max_len}: ~{len(frequent)} itemsets")
+            break
+        break
+    
+    print(f"Chosen min_support={chosen[0]:g}, max_len={chosen[1]} "
+          f"(budget: {max_itemsets} itemsets)")
+    return chosen
+
+def apply_fp_growth(basket, min_support=0.01, engine='fpgrowth', sparse=None, workers=1,
+                    max_len=None, budget=None):
+    """
+    Áp dụng FP-Growth algorithm (hoặc Eclat với engine='eclat')
+    
+    sparse: True/False ép kiểu encoding cho fpgrowth, None để tự chọn
+    workers: > 1 để mine song song theo partition item trên process pool
+    budget: Budget(max_itemsets, max_memory_mb); mine theo partition và
+    raise BudgetExceeded ngay khi vượt
+    """
+    basket = encode_baskets(basket)
+    name = 'Eclat (bitset)' if engine == 'eclat' else 'FP-Growth'
+    
+    if workers > 1 or budget is not None:
+        print(f"\nRunning partitioned {name} with min_support={min_support}, "
+              f"max_len={max_len}, workers={workers}...")
+        frequent_itemsets = parallel_mine(basket, min_support, engine, workers, sparse,
+                                          max_len, budget)
+    else:
+        print(f"\nRunning {name} with min_support={min_support}...")
+        frequent_itemsets = mine_itemsets(basket, min_support, engine, sparse, max_len)
     
     print(f"Found {len(frequent_itemsets)} frequent itemsets")
     return frequent_itemsets
 
+def apply_with_budget(basket, budget, engine='fpgrowth', sparse=None, workers=1,
+                      max_retries=5):
+    """
+    Tự chọn min_support/max_len theo ngân sách rồi mine
+    
+    Nếu vẫn vượt ngân sách giữa chừng, tăng gấp đôi min_support và chạy lại.
+    Returns (frequent_itemsets, min_support, max_len)
+    """
+    basket = encode_baskets(basket)
+    min_support, max_len = choose_thresholds(basket, budget)
+    
+    for attempt in range(max_retries + 1):
+        try:
+            frequent_itemsets = apply_fp_growth(basket, min_support, engine, sparse, workers,
+                                                max_len, budget)
+            return frequent_itemsets, min_support, max_len
+        except BudgetExceeded as e:
+            if attempt == max_retries or min_support >= 1.0:
+                raise
+            print(f"✗ Budget exceeded ({e}), retrying with stricter threshold")
+            min_support = min(1.0, min_support * 2)
+
+def count_itemsets(baskets, itemsets):
+    """Đếm chính xác số giao dịch chứa mỗi itemset (tuple tên item)"""
+    item_codes = {item: i for i, item in enumerate(baskets.items)}
+    involved = sorted({item_codes[item] for itemset in itemsets
+                       for item in itemset if item in item_codes})
+    bitsets = build_item_bitsets(baskets, np.asarray(involved, dtype=np.int64))
+    row_of = {code: row for row, code in enumerate(involved)}
+    
+    counts = np.zeros(len(itemsets), dtype=np.int64)
+    for k, itemset in enumerate(itemsets):
+        if all(item in item_codes for item in itemset):
+            rows = [row_of[item_codes[item]] for item in itemset]
+            counts[k] = _popcount(np.bitwise_and.reduce(bitsets[rows], axis=0))
+    return counts
+
+def apriori_gen(frequent_k):
+    """Sinh ứng viên k+1 từ các itemset phổ biến k (tuple đã sort)"""
+    frequent_k = sorted(frequent_k)
+    known = set(frequent_k)
+    candidates = []
+    for i, a in enumerate(frequent_k):
+        for b in frequent_k[i + 1:]:
+            if a[:-1] != b[:-1]:
+                break
+            candidate = a + (b[-1],)
+            if all(subset in known for subset in combinations(candidate, len(candidate) - 1)):
+                candidates.append(candidate)
+    return candidates
+
+def fup_update(old_counts, n_old, new_baskets, min_support, count_history):
+    """
+    FUP: cập nhật frequent itemsets khi có thêm giao dịch mới
+    
+    old_counts: {itemset: count} các itemset phổ biến của lần chạy trước
+    count_history(itemsets): đếm itemsets trên dữ liệu cũ, chỉ gọi cho các
+    itemset trước đây không phổ biến nhưng phổ biến trong phần dữ liệu mới
+    
+    Returns ({itemset: count}, số itemset phải re-check trên dữ liệu cũ)
+    """
+    n_new = new_baskets.n_transactions
+    n_total = n_old + n_new
+    
+    updated = {}
+    n_rechecked = 0
+    candidates = sorted(
+        {itemset for itemset in old_counts if len(itemset) == 1}
+        | {(item,) for item in new_baskets.items}
+    )
+    while candidates:
+        new_counts = count_itemsets(new_baskets, candidates)
+        frequent_k, recheck, recheck_counts = [], [], []
+        
+        for itemset, count in zip(candidates, new_counts):
+            if itemset in old_counts:
+                total = old_counts[itemset] + int(count)
+                if total / n_total >= min_support:
+                    updated[itemset] = total
+                    frequent_k.append(itemset)
+            # Itemset cũ không phổ biến chỉ có thể thành phổ biến
+            # nếu nó phổ biến trong phần dữ liệu mới
+            elif count >= min_support * n_new * (1 - 1e-9):
+                recheck.append(itemset)
+                recheck_counts.append(int(count))
+        
+        if recheck:
+            n_rechecked += len(recheck)
+            for itemset, count, old in zip(recheck, recheck_counts, count_history(recheck)):
+                total = int(old) + count
+                if total / n_total >= min_support:
+                    updated[itemset] = total
+                    frequent_k.append(itemset)
+        
+        candidates = apriori_gen(frequent_k)
+    
+    return updated, n_rechecked
+
+def load_mining_state(engine, table_name):
+    """Đọc số đếm itemset và watermark của lần chạy trước (None nếu chưa có)"""
+    tables = inspect(engine).get_table_names()
+    if f'{table_name}_state' not in tables or f'{table_name}_itemsets' not in tables:
+        return None
+    
+    state = pd.read_sql(f'SELECT * FROM {table_name}_state', engine)
+    if state.empty:
+        return None
+    itemsets = pd.read_sql(f'SELECT itemset, count FROM {table_name}_itemsets', engine)
+    
+    row = state.iloc[0]
+    return {
+        'n_transactions': int(row['n_transactions']),
+        # State cũ chưa lưu n_rows: chỉ kiểm tra được số giao dịch
+        'n_rows': int(row['n_rows']) if 'n_rows' in row and pd.notna(row['n_rows']) else None,
+        'last_txn_id': int(row['last_txn_id']),
+        'min_support': float(row['min_support']),
+        'counts': {
+            tuple(json.loads(itemset)): int(count)
+            for itemset, count in zip(itemsets['itemset'], itemsets['count'])
+        }
+    }
+
+def history_counts(engine, last_txn_id):
+    """(số giao dịch, số dòng item) của stg_transaction_items với txn_id <= last_txn_id"""
+    with engine.connect() as conn:
+        n_transactions, n_rows = conn.execute(text("""
+            SELECT COUNT(DISTINCT txn_id), COUNT(*)
+            FROM stg_transaction_items
+            WHERE txn_id <= :last_txn_id
+        """), {'last_txn_id': last_txn_id}).one()
+    return int(n_transactions), int(n_rows)
+
+def state_matches_history(engine, state):
+    """
+    Watermark chỉ đúng khi txn_id ổn định và chỉ tăng thêm: nếu phần dữ liệu
+    cũ (txn_id <= last_txn_id) không còn đúng số giao dịch / số dòng đã mine
+    (vd. dbt rebuild đánh lại txn_id) thì state không dùng được nữa
+    """
+    n_transactions, n_rows = history_counts(engine, state['last_txn_id'])
+    if n_transactions != state['n_transactions']:
+        print(f"✗ {n_transactions} transactions with txn_id <= {state['last_txn_id']}, "
+              f"state has {state['n_transactions']}")
+        return False
+    if state['n_rows'] is not None and n_rows != state['n_rows']:
+        print(f"✗ {n_rows} item rows with txn_id <= {state['last_txn_id']}, "
+              f"state has {state['n_rows']}")
+        return False
+    return True
+
+def save_mining_state(engine, table_name, counts, n_transactions, last_txn_id, min_support):
+    """Lưu số đếm nguyên của các itemset phổ biến cho lần chạy incremental sau"""
+    _, n_rows = history_counts(engine, last_txn_id)
+    pd.DataFrame({
+        'itemset': [json.dumps(list(itemset)) for itemset in counts],
+        'count': list(counts.values())
+    }).to_sql(f'{table_name}_itemsets', engine, if_exists='replace', index=False)
+    
+    pd.DataFrame([{
+        'n_transactions': n_transactions,
+        'n_rows': n_rows,
+        'last_txn_id': last_txn_id,
+        'min_support': min_support,
+        'updated_at': datetime.now()
+    }]).to_sql(f'{table_name}_state', engine, if_exists='replace', index=False)
+
+def itemset_counts(frequent_itemsets, n_transactions):
+    """frequent_itemsets (support, itemsets) -> {tuple item đã sort: count}"""
+    counts = np.rint(frequent_itemsets['support'].to_numpy() * n_transactions).astype(np.int64)
+    return {
+        tuple(sorted(itemset)): int(count)
+        for itemset, count in zip(frequent_itemsets['itemsets'], counts)
+    }
+
+def counts_to_frame(counts, n_transactions):
+    """{itemset: count} -> DataFrame (support, itemsets) như mlxtend"""
+    return pd.DataFrame({
+        'support': np.asarray(list(counts.values()), dtype=np.int64) / max(n_transactions, 1),
+        'itemsets': [frozenset(itemset) for itemset in counts]
+    })
+
+def run_incremental(engine, state, min_support, chunk_size=100_000):
+    """
+    Cập nhật frequent itemsets chỉ từ các giao dịch mới sau watermark
+    
+    Cần txn_id ổn định và tăng dần (giao dịch mới luôn có txn_id lớn hơn);
+    kiểm tra state bằng state_matches_history trước khi gọi.
+    """
+    print(f"\nIncremental update from txn_id > {state['last_txn_id']} "
+          f"({state['n_transactions']} transactions already mined)...")
+    new_baskets = load_transactions(engine, chunk_size, after_txn_id=state['last_txn_id'])
+    
+    # Ứng viên ở mọi mức chỉ gồm item phổ biến ở mức 1, tức item phổ biến
+    # cũ hoặc item đang được re-check: đọc lịch sử một lần cho cả lần cập nhật
+    old_items = {item for itemset in state['counts'] if len(itemset) == 1 for item in itemset}
+    history = {}
+
+    def count_history(itemsets):
+        if 'baskets' not in history:
+            history['baskets'] = load_transactions(
+                engine,
+                chunk_size,
+                up_to_txn_id=state['last_txn_id'],
+                items=sorted(old_items | {item for itemset in itemsets for item in itemset}),
+                verbose=False
+            )
+        return count_itemsets(history['baskets'], itemsets)
+    
+    n_total = state['n_transactions'] + new_baskets.n_transactions
+    if new_baskets.n_transactions == 0:
+        counts, n_rechecked = state['counts'], 0
+        last_txn_id = state['last_txn_id']
+    else:
+        counts, n_rechecked = fup_update(
+            state['counts'],
+            state['n_transactions'],
+            new_baskets,
+            min_support,
+            count_history
+        )
+        last_txn_id = int(new_baskets.txn_ids[-1])
+    
+    print(f"Found {len(counts)} frequent itemsets "
+          f"({n_rechecked} border itemsets re-checked against history)")
+    return counts, n_total, last_txn_id
+
+def encode_itemsets(frequent_itemsets):
+    """
+    Mã hoá frequent itemsets thành mảng số nguyên theo độ dài
+    
+    Returns (items, blocks) với items là tên item đã sort và
+    blocks[k] = (codes n_k x k đã sort, itemset ids, support)
+    """
+    itemsets = frequent_itemsets['itemsets'].tolist()
+    support = frequent_itemsets['support'].to_numpy(dtype=np.float64)
+    items = sorted({item for itemset in itemsets for item in itemset})
+    item_codes = {item: i for i, item in enumerate(items)}
+    
+    lengths = np.fromiter((len(itemset) for itemset in itemsets), dtype=np.int64,
+                          count=len(itemsets))
+    blocks = {}
+    for k in np.unique(lengths):
+        ids = np.flatnonzero(lengths == k)
+        codes = np.array(
+            [sorted(item_codes[item] for item in itemsets[i]) for i in ids],
+            dtype=np.int32
+        ).reshape(len(ids), k)
+        blocks[int(k)] = (codes, ids, support[ids])
+    return items, blocks
+
+def _itemset_labels(items, blocks, n_itemsets):
+    """Chuỗi 'A, B' cho từng itemset, dựng theo cột trên cả block"""
+    names = np.asarray(items, dtype=object)
+    labels = np.empty(n_itemsets, dtype=object)
+    for k, (codes, ids, _) in blocks.items():
+        label = names[codes[:, 0]]
+        for c in range(1, k):
+            label = label + ', ' + names[codes[:, c]]
+        labels[ids] = label
+    return labels
+
 def generate_rules(frequent_itemsets, min_confidence=0.1, min_lift=1.0):
-    """Generate association rules"""
+    """
+    Generate association rules
+    
+    Mọi antecedent/consequent đều là frequent itemset, nên mỗi rule chỉ là
+    cặp itemset id; metric tính bằng phép toán trên mảng cho từng cách
+    chia (k, vị trí antecedent). antecedent/consequent trả về dạng
+    Categorical: chuỗi chỉ được ghép thành từng dòng khi ghi ra.
+    """
     print(f"\nGenerating rules with min_confidence={min_confidence}, min_lift={min_lift}...")
     
-    rules = association_rules(
-        frequent_itemsets,
-        metric="confidence",
-        min_threshold=min_confidence,
-        num_itemsets=len(frequent_itemsets)
-    )
+    frequent_itemsets = frequent_itemsets.reset_index(drop=True)
+    items, blocks = encode_itemsets(frequent_itemsets)
     
-    # Filter by lift
-    rules = rules[rules['lift'] >= min_lift]
+    # Tra cứu itemset id theo mã item (k=1 tra mảng, k>=2 qua MultiIndex)
+    lookup = {}
+    for k, (codes, ids, _) in blocks.items():
+        if k == 1:
+            single = np.full(len(items), -1, dtype=np.int64)
+            single[codes[:, 0]] = ids
+            lookup[k] = single
+        else:
+            lookup[k] = (pd.MultiIndex.from_arrays([codes[:, c] for c in range(k)]), ids)
     
-    # Convert frozenset to string
-    rules['antecedent'] = rules['antecedents'].apply(lambda x: ', '.join(list(x)))
-    rules['consequent'] = rules['consequents'].apply(lambda x: ', '.join(list(x)))
+    def itemset_ids(codes):
+        k = codes.shape[1]
+        if k not in lookup:
+            return np.full(len(codes), -1, dtype=np.int64)
+        if k == 1:
+            return lookup[1][codes[:, 0]]
+        index, ids = lookup[k]
+        pos = index.get_indexer(pd.MultiIndex.from_arrays([codes[:, c] for c in range(k)]))
+        return np.where(pos >= 0, ids[pos], -1)
     
-    # Select và rename columns
-    rules_clean = rules[[
-        'antecedent', 
-        'consequent', 
-        'support', 
-        'confidence', 
-        'lift'
-    ]].copy()
+    support_all = frequent_itemsets['support'].to_numpy(dtype=np.float64)
+    parts = []
+    for k, (codes, ids, support) in blocks.items():
+        for j in range(1, k):
+            for ante_pos in combinations(range(k), j):
+                cons_pos = [c for c in range(k) if c not in ante_pos]
+                ante_ids = itemset_ids(codes[:, list(ante_pos)])
+                cons_ids = itemset_ids(codes[:, cons_pos])
+                
+                valid = (ante_ids >= 0) & (cons_ids >= 0)
+                confidence = np.zeros(len(ids))
+                lift = np.zeros(len(ids))
+                confidence[valid] = support[valid] / support_all[ante_ids[valid]]
+                lift[valid] = confidence[valid] / support_all[cons_ids[valid]]
+                
+                # Support là float (count / n): nới nhẹ để rule có metric đúng
+                # bằng ngưỡng (vd. 32/320 = 0.0999...) không bị loại
+                keep = valid & (confidence >= min_confidence * (1 - 1e-9)) \
+                    & (lift >= min_lift * (1 - 1e-9))
+                if keep.any():
+                    parts.append((ante_ids[keep], cons_ids[keep], support[keep],
+                                  confidence[keep], lift[keep]))
     
-    # Round numbers
-    rules_clean['support'] = rules_clean['support'].round(4)
-    rules_clean['confidence'] = rules_clean['confidence'].round(4)
-    rules_clean['lift'] = rules_clean['lift'].round(4)
+    if parts:
+        ante_ids, cons_ids, support, confidence, lift = (
+            np.concatenate(column) for column in zip(*parts)
+        )
+    else:
+        ante_ids = cons_ids = np.empty(0, dtype=np.int64)
+        support = confidence = lift = np.empty(0)
+    
+    # Chỉ các itemset thực sự xuất hiện trong rules mới cần nhãn
+    used, codes = np.unique(np.concatenate([ante_ids, cons_ids]), return_inverse=True)
+    labels = _itemset_labels(items, blocks, len(frequent_itemsets))[used]
+    categories = pd.Index(labels.astype(str) if len(labels) else [], dtype=object)
+    
+    rules_clean = pd.DataFrame({
+        'antecedent': pd.Categorical.from_codes(codes[:len(ante_ids)], categories),
+        'consequent': pd.Categorical.from_codes(codes[len(ante_ids):], categories),
+        'support': np.round(support, 4),
+        'confidence': np.round(confidence, 4),
+        'lift': np.round(lift, 4)
+    })
     
     print(f"Generated {len(rules_clean)} rules")
     return rules_clean
 
+# Số item mỗi khối bitset của mine_top_k_rules: bitset chỉ được dựng theo
+# khối khi item còn trên ngưỡng support nội bộ
+TOP_K_BITSET_BLOCK = 256
+# Số itemset giữ support count trong cache khi sinh rule
+TOP_K_COUNT_CACHE = 1 << 16
+
+def mine_top_k_rules(basket, k, by='lift', min_confidence=0.1, min_lift=1.0, min_support=None):
+    """
+    K rule tốt nhất theo `by` (lift hoặc confidence)
+    
+    Eclat trên bitset, giữ K rule tốt nhất theo (by, support) trong min-heap;
+    khi heap đầy, metric của rule thứ K thành ngưỡng loại rule (confidence
+    cần support(X) <= support(X∪Y) / ngưỡng, lift <= 1 / support(X∪Y)).
+    Lift và confidence không đơn điệu theo itemset nên chỉ nâng được ngưỡng
+    support khi rule thứ K đã đạt giá trị lớn nhất (confidence = 1): rule
+    mới phải có support lớn hơn nó. min_support là ngưỡng nhiễu (rule hiếm
+    luôn có lift/confidence cao), không quyết định số rule trả về.
+    Bitset item được dựng theo khối TOP_K_BITSET_BLOCK item, chỉ cho các
+    item còn trên ngưỡng support nội bộ.
+    """
+    baskets = encode_baskets(basket)
+    n_transactions = baskets.n_transactions
+    min_count = max(1, int(np.ceil((min_support or 0) * n_transactions * (1 - 1e-9))))
+    print(f"\nMining top {k} rules by {by} (min_support={min_support}, "
+          f"min_confidence={min_confidence}, min_lift={min_lift})...")
+    
+    # Hạng item theo support giảm dần; bitset của hạng r nằm ở khối r // block
+    all_counts = np.bincount(baskets.indices, minlength=len(baskets.items))
+    item_ids = np.flatnonzero(all_counts >= min_count)
+    item_ids = item_ids[np.argsort(-all_counts[item_ids], kind='stable')]
+    item_counts = all_counts[item_ids]
+    block = TOP_K_BITSET_BLOCK
+    blocks = {}
+    
+    def block_bits(b):
+        if b not in blocks:
+            blocks[b] = build_item_bitsets(baskets, item_ids[b * block:(b + 1) * block])
+        return blocks[b]
+    
+    def item_bits(rank):
+        return block_bits(rank // block)[rank % block]
+    
+    @functools.lru_cache(maxsize=TOP_K_COUNT_CACHE)
+    def support_count(itemset):
+        if len(itemset) == 1:
+            return int(item_counts[itemset[0]])
+        bits = item_bits(itemset[0])
+        for rank in itemset[1:]:
+            bits = bits & item_bits(rank)
+        return int(_popcount(bits))
+    
+    heap = []
+    tiebreak = count()
+    tolerance = 1 - 1e-9
+    
+    def add_rules(itemset, itemset_count):
+        nonlocal min_count
+        threshold = heap[0][0] if len(heap) == k else None
+        if by == 'lift' and threshold is not None and n_transactions / itemset_count < threshold:
+            return
+        for j in range(1, len(itemset)):
+            for antecedent in combinations(itemset, j):
+                antecedent_count = support_count(antecedent)
+                confidence = itemset_count / antecedent_count
+                if confidence < min_confidence * tolerance:
+                    continue
+                if by == 'confidence' and threshold is not None and confidence < threshold:
+                    continue
+                consequent = tuple(x for x in itemset if x not in antecedent)
+                lift = confidence * n_transactions / support_count(consequent)
+                if lift < min_lift * tolerance:
+                    continue
+                
+                metric = lift if by == 'lift' else confidence
+                rule = (metric, itemset_count, next(tiebreak), antecedent, consequent, confidence, lift)
+                if len(heap) < k:
+                    heapq.heappush(heap, rule)
+                elif rule[:2] > heap[0][:2]:
+                    heapq.heapreplace(heap, rule)
+                else:
+                    continue
+                if len(heap) == k:
+                    threshold = heap[0][0]
+                    # Rule thứ K có confidence = 1: rule mới chỉ vượt được
+                    # nhờ support lớn hơn, cắt mọi itemset không đủ support
+                    if by == 'confidence' and threshold >= 1.0:
+                        min_count = max(min_count, heap[0][1] + 1)
+    
+    def extend(prefix, cand_ranks, cand_bits, cand_counts):
+        # Ứng viên xếp theo support giảm dần: gặp count < ngưỡng là dừng
+        order = np.argsort(-cand_counts, kind='stable')
+        cand_ranks, cand_bits, cand_counts = cand_ranks[order], cand_bits[order], cand_counts[order]
+        for i in range(len(cand_ranks)):
+            if cand_counts[i] < min_count:
+                break
+            itemset = tuple(sorted(prefix + (int(cand_ranks[i]),)))
+            add_rules(itemset, int(cand_counts[i]))
+            
+            next_bits = cand_bits[i + 1:] & cand_bits[i]
+            next_counts = _popcount(next_bits)
+            keep = next_counts >= min_count
+            if keep.any():
+                extend(itemset, cand_ranks[i + 1:][keep],
+                       next_bits[keep], next_counts[keep])
+    
+    for rank in range(len(item_ids)):
+        if item_counts[rank] < min_count:
+            break
+        bits = item_bits(rank)
+        # Ứng viên cấp 2: item hạng sau còn trên ngưỡng, AND theo từng khối
+        # và chỉ giữ lại hàng đủ support (không dựng ma trận n_items x n_txn)
+        last = int(np.searchsorted(-item_counts, -min_count, side='right'))
+        cand_ranks, cand_bits, cand_counts = [], [], []
+        start = rank + 1
+        while start < last:
+            b = start // block
+            stop = min(last, (b + 1) * block)
+            pair_bits = block_bits(b)[start % block:stop - b * block] & bits
+            pair_counts = _popcount(pair_bits)
+            keep = np.flatnonzero(pair_counts >= min_count)
+            cand_ranks.append(start + keep)
+            cand_bits.append(pair_bits[keep])
+            cand_counts.append(pair_counts[keep])
+            start = stop
+        if cand_ranks:
+            extend((rank,), np.concatenate(cand_ranks), np.concatenate(cand_bits),
+                   np.concatenate(cand_counts))
+    
+    print(f"Internal min_support ended at {min_count / max(n_transactions, 1):.4f} "
+          f"({min_count} transactions)")
+    
+    def label(itemset):
+        return ', '.join(sorted(baskets.items[item_ids[rank]] for rank in itemset))
+    
+    rules = pd.DataFrame(
+        [{
+            'antecedent': label(antecedent),
+            'consequent': label(consequent),
+            'support': round(rule_count / n_transactions, 4),
+            'confidence': round(confidence, 4),
+            'lift': round(lift, 4)
+        } for _, rule_count, _, antecedent, consequent, confidence, lift in heap],
+        columns=['antecedent', 'consequent', 'support', 'confidence', 'lift']
+    )
+    rules = rules.sort_values([by, 'support'], ascending=False, ignore_index=True)
+    
+    print(f"Generated {len(rules)} rules")
+    return rules
+
+# Index dựng trên bảng staging trước khi swap, theo các truy vấn của API
+RULE_INDEXES = {
+    # GET /rules: ORDER BY lift DESC, confidence DESC, id DESC (keyset),
+    # đọc thẳng từ index
+    'lift_confidence_idx': '(lift DESC, confidence DESC, id DESC) '
+                           'INCLUDE (support, antecedent, consequent, created_at)',
+    # /recommend: antecedent_ids <@ item id của giỏ; /rules/search: &&
+    'antecedent_ids_idx': 'USING GIN (antecedent_ids)',
+    'consequent_ids_idx': 'USING GIN (consequent_ids)',
+}
+
+def rule_item_arrays(rules):
+    """
+    Mã hoá antecedent/consequent của rules thành mảng item id
+    
+    Item id đánh theo tên item viết thường, vì API so khớp giỏ hàng không
+    phân biệt hoa thường. Mỗi nhãn 'A, B' chỉ được tách một lần.
+    Returns (item_keys, antecedent_ids, consequent_ids) với hai mảng sau
+    là literal INTEGER[] ('{1,2}') cho từng rule.
+    """
+    antecedent = rules['antecedent'].astype('category')
+    consequent = rules['consequent'].astype('category')
+    labels = set(antecedent.cat.categories) | set(consequent.cat.categories)
+    parts = {label: [item.lower() for item in label.split(', ')] for label in labels}
+    item_keys = sorted({item for items in parts.values() for item in items})
+    key_ids = {key: i for i, key in enumerate(item_keys)}
+    literals = {
+        label: '{' + ','.join(map(str, sorted({key_ids[item] for item in items}))) + '}'
+        for label, items in parts.items()
+    }
+    
+    def to_literals(column):
+        categories = np.asarray([literals[c] for c in column.cat.categories], dtype=object)
+        return categories[column.cat.codes.to_numpy()]
+    
+    return item_keys, to_literals(antecedent), to_literals(consequent)
+
+def summarize_rules(rules):
+    """
+    Thống kê cho /rules/stats và /rules/top-items, tính một lần lúc ghi
+    
+    Returns (summary một dòng, item_frequency). Tần suất tính theo từng item
+    (số rule chứa item ở mỗi vế) và total_items là số item phân biệt
+    (viết thường) trên cả hai vế; mỗi nhãn chỉ được tách một lần.
+    """
+    parts = []
+    for side in ('antecedent', 'consequent'):
+        counts = rules[side].value_counts()
+        counts = counts[counts > 0]
+        parts.append(pd.DataFrame({
+            'item_name': counts.index.astype(str).str.split(', '),
+            f'{side}_rules': counts.to_numpy()
+        }).explode('item_name'))
+    items = pd.concat(parts, ignore_index=True)
+    items['item_key'] = items['item_name'].str.lower()
+    frequency = items.groupby('item_key', as_index=False).agg(
+        item_name=('item_name', 'min'),
+        antecedent_rules=('antecedent_rules', 'sum'),
+        consequent_rules=('consequent_rules', 'sum')
+    )
+    frequency[['antecedent_rules', 'consequent_rules']] = (
+        frequency[['antecedent_rules', 'consequent_rules']].astype(np.int64)
+    )
+    frequency['frequency'] = frequency['antecedent_rules'] + frequency['consequent_rules']
+    frequency = frequency.sort_values(['frequency', 'item_name'], ascending=[False, True],
+                                      ignore_index=True)
+    
+    summary = pd.DataFrame([{
+        'total_rules': len(rules),
+        'total_items': len(frequency),
+        'avg_confidence': rules['confidence'].mean(),
+        'avg_lift': rules['lift'].mean(),
+        'avg_support': rules['support'].mean(),
+        'min_confidence': rules['confidence'].min(),
+        'max_confidence': rules['confidence'].max(),
+        'min_lift': rules['lift'].min(),
+        'max_lift': rules['lift'].max(),
+        'created_at': rules['created_at'].iloc[0] if len(rules) else datetime.now()
+    }])
+    return summary, frequency[['item_key', 'item_name', 'antecedent_rules',
+                               'consequent_rules', 'frequency']]
+
+def _copy_rows(cursor, frame, table_name, chunk_size=100_000):
+    """
+    Stream DataFrame vào bảng bằng COPY FROM STDIN, mỗi lần chunk_size dòng
+    
+    FREEZE (bảng vừa tạo trong cùng transaction) đánh dấu trang all-visible
+    ngay, nên index-only scan dùng được mà không cần chờ VACUUM.
+    """
+    columns = ', '.join(frame.columns)
+    for start in range(0, len(frame), chunk_size):
+        buffer = io.StringIO()
+        frame.iloc[start:start + chunk_size].to_csv(buffer, header=False, index=False)
+        buffer.seek(0)
+        cursor.copy_expert(
+            f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv, FREEZE)",
+            buffer
+        )
+
+def _swap_table(cursor, staging, table_name, index_names):
+    """Thay bảng cũ bằng bảng staging; index đổi tên theo bảng mới"""
+    cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+    cursor.execute(f"ALTER TABLE {staging} RENAME TO {table_name}")
+    for name in index_names:
+        cursor.execute(f"ALTER INDEX {staging}_{name} RENAME TO {table_name}_{name}")
+
+# Chờ lock tối đa SWAP_LOCK_TIMEOUT mỗi lần thử: một reader chạy lâu (vd.
+# /rules/export) không được giữ swap, và các query API xếp hàng sau nó, quá lâu
+SWAP_LOCK_TIMEOUT = '2s'
+SWAP_RETRIES = 10
+LOCK_NOT_AVAILABLE = '55P03'
+
+def _swap_tables(cursor, swaps, retries=SWAP_RETRIES):
+    """
+    Chạy các _swap_table trong một savepoint với lock_timeout;
+    hết thời gian chờ lock thì rollback về savepoint và thử lại
+    """
+    cursor.execute(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}'")
+    for attempt in range(retries + 1):
+        cursor.execute("SAVEPOINT swap")
+        try:
+            for swap in swaps:
+                _swap_table(cursor, *swap)
+            cursor.execute("RELEASE SAVEPOINT swap")
+            return
+        except Exception as e:
+            if getattr(e, 'pgcode', None) != LOCK_NOT_AVAILABLE or attempt == retries:
+                raise
+            cursor.execute("ROLLBACK TO SAVEPOINT swap")
+            print(f"✗ Swap waiting on a long-running reader, retrying ({attempt + 1}/{retries})")
+            time.sleep(min(2 ** attempt, 30))
+
 def save_to_database(rules, engine, table_name='fp_growth_rules'):
-    """Lưu rules vào PostgreSQL"""
+    """
+    Lưu rules vào PostgreSQL
+    
+    COPY vào bảng staging, dựng index trên đó rồi đổi tên thay bảng cũ
+    trong cùng một transaction, nên API không bao giờ thấy bảng
+    bị thiếu hoặc đang nạp dở. Bảng `<table>_items` (item id -> tên viết
+    thường) được thay cùng lúc với mảng antecedent_ids/consequent_ids, cùng
+    `<table>_summary` và `<table>_item_frequency` (xem summarize_rules).
+    """
+    # API đọc mảng INTEGER[] (toán tử <@, &&) và index GIN: chỉ PostgreSQL
+    if engine.dialect.name != 'postgresql':
+        raise ValueError(f"save_to_database needs PostgreSQL, got {engine.dialect.name}")
+    
     print(f"\nSaving {len(rules)} rules to table '{table_name}'...")
     
     # Add timestamp
     rules['created_at'] = datetime.now()
+    summary, item_frequency = summarize_rules(rules)
+    summary_table = f'{table_name}_summary'
+    frequency_table = f'{table_name}_item_frequency'
     
-    # Save to database (replace existing table)
-    rules.to_sql(
-        table_name, 
-        engine, 
-        if_exists='replace', 
-        index=False,
-        method='multi'
+    item_keys, antecedent_ids, consequent_ids = rule_item_arrays(rules)
+    rows = rules[['antecedent', 'consequent', 'support', 'confidence', 'lift', 'created_at']].assign(
+        antecedent_ids=antecedent_ids,
+        consequent_ids=consequent_ids
     )
+    rows.insert(0, 'id', np.arange(1, len(rows) + 1))
+    items_table = f'{table_name}_items'
+    
+    staging = f'{table_name}_staging'
+    items_staging = f'{items_table}_staging'
+    summary_staging = f'{summary_table}_staging'
+    frequency_staging = f'{frequency_table}_staging'
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+            cursor.execute(f"""
+                CREATE TABLE {staging} (
+                    id BIGINT NOT NULL,
+                    antecedent TEXT NOT NULL,
+                    consequent TEXT NOT NULL,
+                    support DOUBLE PRECISION NOT NULL,
+                    confidence DOUBLE PRECISION NOT NULL,
+                    lift DOUBLE PRECISION NOT NULL,
+                    created_at TIMESTAMP NOT NULL,
+                    antecedent_ids INTEGER[] NOT NULL,
+                    consequent_ids INTEGER[] NOT NULL
+                )
+            """)
+            _copy_rows(cursor, rows, staging)
+            
+            cursor.execute(f"DROP TABLE IF EXISTS {items_staging}")
+            cursor.execute(f"""
+                CREATE TABLE {items_staging} (
+                    item_id INTEGER NOT NULL,
+                    item_key TEXT NOT NULL
+                )
+            """)
+            _copy_rows(cursor, pd.DataFrame({'item_id': range(len(item_keys)),
+                                             'item_key': item_keys}), items_staging)
+            cursor.execute(f"ALTER TABLE {items_staging} "
+                           f"ADD CONSTRAINT {items_staging}_pkey PRIMARY KEY (item_id)")
+            cursor.execute(f"CREATE UNIQUE INDEX {items_staging}_item_key_idx "
+                           f"ON {items_staging} (item_key)")
+            
+            cursor.execute(f"DROP TABLE IF EXISTS {summary_staging}")
+            cursor.execute(f"""
+                CREATE TABLE {summary_staging} (
+                    total_rules BIGINT NOT NULL,
+                    total_items BIGINT NOT NULL,
+                    avg_confidence DOUBLE PRECISION,
+                    avg_lift DOUBLE PRECISION,
+                    avg_support DOUBLE PRECISION,
+                    min_confidence DOUBLE PRECISION,
+                    max_confidence DOUBLE PRECISION,
+                    min_lift DOUBLE PRECISION,
+                    max_lift DOUBLE PRECISION,
+                    created_at TIMESTAMP NOT NULL
+                )
+            """)
+            _copy_rows(cursor, summary, summary_staging)
+            
+            cursor.execute(f"DROP TABLE IF EXISTS {frequency_staging}")
+            cursor.execute(f"""
+                CREATE TABLE {frequency_staging} (
+                    item_key TEXT NOT NULL,
+                    item_name TEXT NOT NULL,
+                    antecedent_rules BIGINT NOT NULL,
+                    consequent_rules BIGINT NOT NULL,
+                    frequency BIGINT NOT NULL
+                )
+            """)
+            _copy_rows(cursor, item_frequency, frequency_staging)
+            cursor.execute(f"ALTER TABLE {frequency_staging} "
+                           f"ADD CONSTRAINT {frequency_staging}_pkey PRIMARY KEY (item_key)")
+            cursor.execute(f"CREATE INDEX {frequency_staging}_frequency_idx "
+                           f"ON {frequency_staging} (frequency DESC, item_name)")
+            
+            cursor.execute(f"ALTER TABLE {staging} "
+                           f"ADD CONSTRAINT {staging}_pkey PRIMARY KEY (id)")
+            for name, definition in RULE_INDEXES.items():
+                cursor.execute(f"CREATE INDEX {staging}_{name} ON {staging} {definition}")
+            cursor.execute(f"ANALYZE {staging}")
+            cursor.execute(f"ANALYZE {items_staging}")
+            
+            # Atomic swap: reader chỉ chờ lock trong lúc đổi tên
+            _swap_tables(cursor, [
+                (staging, table_name, ['pkey', *RULE_INDEXES]),
+                (items_staging, items_table, ['pkey', 'item_key_idx']),
+                (summary_staging, summary_table, []),
+                (frequency_staging, frequency_table, ['pkey', 'frequency_idx']),
+            ])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
     
     print(f"✓ Rules saved successfully to '{table_name}' table")
 
@@ -136,29 +1348,107 @@ def main():
                         help='Minimum confidence threshold (default: 0.1)')
     parser.add_argument('--min-lift', type=float, default=1.0,
                         help='Minimum lift threshold (default: 1.0)')
+    parser.add_argument('--engine', choices=['fpgrowth', 'eclat'], default='fpgrowth',
+                        help='Mining engine (default: fpgrowth)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Worker processes for parallel mining (default: 1)')
+    parser.add_argument('--sparse', action='store_true', default=None,
+                        help='Force sparse CSR encoding (default: auto by density)')
+    parser.add_argument('--chunk-size', type=int, default=100_000,
+                        help='Rows fetched per server-side cursor batch (default: 100000)')
+    parser.add_argument('--max-itemsets', type=int, default=None,
+                        help='Itemset budget; picks min_support/max_len automatically '
+                             '(--workers 1 only)')
+    parser.add_argument('--max-memory', type=float, default=None,
+                        help='Memory budget in MB; picks min_support/max_len automatically '
+                             '(--workers 1 only)')
+    parser.add_argument('--top-k', type=int, default=None,
+                        help='Mine the K best rules by --by directly; --min-support is only '
+                             'a noise floor and does not decide how many rules are kept')
+    parser.add_argument('--by', choices=['lift', 'confidence'], default='lift',
+                        help='Ranking metric for --top-k (default: lift)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Update rules from transactions added since the last run (FUP); '
+                             'needs stable, increasing txn_ids')
     parser.add_argument('--table-name', type=str, default='fp_growth_rules',
-                        help='Output table name (default: fp_growth_rules)')
+                        help='Output table name; the API reads it via RULES_TABLE (default: fp_growth_rules)')
     parser.add_argument('--no-save', action='store_true',
                         help='Do not save to database (dry run)')
     
     args = parser.parse_args()
+    if (args.max_itemsets is not None or args.max_memory is not None) and args.workers > 1:
+        parser.error('--max-itemsets/--max-memory cannot be combined with --workers > 1 '
+                     '(worker processes are outside the memory budget)')
     
     try:
         # Connect to database
         engine = get_database_connection()
         
-        # Load data
-        basket = load_transactions(engine)
-        
-        # Apply FP-Growth
-        frequent_itemsets = apply_fp_growth(basket, args.min_support)
+        counts = None
+        state = None
+        if args.incremental and args.top_k is None:
+            state = load_mining_state(engine, args.table_name)
+            if state is None or state['min_support'] != args.min_support:
+                print("\nNo incremental state for this min_support, running full mining")
+                state = None
+            elif not state_matches_history(engine, state):
+                print("\nTransactions up to the watermark changed (txn_ids reassigned?), "
+                      "running full mining")
+                state = None
         
-        # Generate rules
-        rules = generate_rules(
-            frequent_itemsets,
-            args.min_confidence,
-            args.min_lift
-        )
+        if args.top_k is not None:
+            # Top-K: ngưỡng support tự nâng trong lúc mine
+            basket = load_transactions(engine, args.chunk_size)
+            rules = mine_top_k_rules(
+                basket,
+                args.top_k,
+                args.by,
+                args.min_confidence,
+                args.min_lift,
+                args.min_support
+            )
+        else:
+            if state is not None:
+                # Incremental: chỉ quét giao dịch mới + re-check itemset biên
+                counts, n_transactions, last_txn_id = run_incremental(
+                    engine, state, args.min_support, args.chunk_size
+                )
+                frequent_itemsets = counts_to_frame(counts, n_transactions)
+            else:
+                # Load data
+                basket = load_transactions(engine, args.chunk_size)
+                
+                # Apply FP-Growth
+                if args.max_itemsets is not None or args.max_memory is not None:
+                    # Ngân sách: tự chọn ngưỡng, min_support đã chọn dùng cho state
+                    frequent_itemsets, args.min_support, max_len = apply_with_budget(
+                        basket,
+                        Budget(args.max_itemsets, args.max_memory),
+                        args.engine,
+                        sparse=args.sparse,
+                        workers=args.workers
+                    )
+                else:
+                    max_len = None
+                    frequent_itemsets = apply_fp_growth(
+                        basket,
+                        args.min_support,
+                        args.engine,
+                        sparse=args.sparse,
+                        workers=args.workers
+                    )
+                n_transactions = basket.n_transactions
+                last_txn_id = int(basket.txn_ids[-1]) if n_transactions else 0
+                # Itemset bị cắt theo max_len thì không dùng được cho FUP
+                if max_len is None:
+                    counts = itemset_counts(frequent_itemsets, n_transactions)
+            
+            # Generate rules
+            rules = generate_rules(
+                frequent_itemsets,
+                args.min_confidence,
+                args.min_lift
+            )
         
         # Print summary
         print_summary(rules)
@@ -166,6 +1456,16 @@ def main():
         # Save to database
         if not args.no_save:
             save_to_database(rules, engine, args.table_name)
+            # Top-K không có tập itemset đầy đủ để cập nhật incremental
+            if counts is not None:
+                save_mining_state(
+                    engine,
+                    args.table_name,
+                    counts,
+                    n_transactions,
+                    last_txn_id,
+                    args.min_support
+                )
         else:
             print("\n[DRY RUN] Rules not saved (use without --no-save to save)")
         